@@ -0,0 +1,139 @@
+import sys, os
+
+# Add project root to sys.path to allow running this file directly
+if __name__ == "__main__" and __package__ is None:
+    root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    sys.path.append(root_dir)
+    __package__ = "src.app"
+
+import asyncio, hmac, inspect
+from dotenv import load_dotenv
+from ..dis_commands import bot
+from ..utils.util import logger, find_guild_by_name, fetch_channels_from_guild, DATA_DIRECTORY
+from ..utils.file_ops import (
+    upload_single_file,
+    upload_folder,
+    download_from_discord,
+    delete_from_discord,
+    list_files_page,
+    rotate_channel_keys,
+    load_folder_manifest,
+    retire_folder_version,
+    resume_upload,
+    verify_object,
+)
+from ..utils.rpc import (
+    TRANSFER_DAEMON,
+    DAEMON_TOKEN,
+    DEFAULT_DAEMON_ADDRESS,
+    parse_address,
+    read_frame,
+    encode_frame,
+    encode_error,
+)
+from ..utils.scheduler import as_requester, scheduler_snapshot
+
+# load details from env
+load_dotenv()
+
+# bot token
+TOKEN = os.getenv("bot_token")
+
+# --- Transfer Daemon ---
+# Owns the single Discord gateway connection. Web workers (src/app/main.py with
+# transfer_daemon set) submit work here, so any number of them can share one bot.
+# Only these operations can be called remotely.
+OPERATIONS = {func.__name__: func for func in (
+    find_guild_by_name,
+    fetch_channels_from_guild,
+    upload_single_file,
+    upload_folder,
+    download_from_discord,
+    delete_from_discord,
+    list_files_page,
+    rotate_channel_keys,
+    load_folder_manifest,
+    retire_folder_version,
+    resume_upload,
+    verify_object,
+    scheduler_snapshot,
+)}
+
+# Arguments that name local files (uploads and handoff files). Operations move and delete
+# them, so they must stay inside the shared data directory; anything else could be used to
+# exfiltrate or delete files.
+PATH_ARGUMENTS = {
+    "upload_single_file": ("file_path",),
+    "upload_folder": ("upload_path",),
+    "retire_folder_version": ("stale_chunks_path",), # Optional
+}
+
+def _check_paths(name, operation, args, kwargs):
+    """Raises PermissionError if a path argument resolves outside DATA_DIRECTORY."""
+    if name not in PATH_ARGUMENTS: return
+    bound = inspect.signature(operation).bind(*args, **kwargs).arguments
+    data_directory = os.path.realpath(DATA_DIRECTORY)
+    for argument in PATH_ARGUMENTS[name]:
+        path = bound.get(argument)
+        if path is None: continue
+        resolved = os.path.realpath(str(path))
+        if resolved == data_directory or os.path.commonpath([data_directory, resolved]) != data_directory:
+            raise PermissionError(f"'{path}' is outside the data directory.")
+
+@bot.event
+async def on_ready():
+    logger.info(f'Transfer daemon logged in as {bot.user}')
+
+async def dispatch(request, peer):
+    if DAEMON_TOKEN and not hmac.compare_digest(str(request.get("token", "")), DAEMON_TOKEN):
+        return {"error": {"type": "PermissionError", "message": "Invalid daemon token."}}
+    operation = OPERATIONS.get(request.get("op"))
+    if operation is None:
+        return {"error": {"type": "LookupError", "message": f"Unknown operation '{request.get('op')}'."}}
+
+    await bot.wait_until_ready()
+    try:
+        args, kwargs = request.get("args", []), request.get("kwargs", {})
+        _check_paths(request["op"], operation, args, kwargs)
+        # Work is attributed to the end user, so the scheduler stays fair across web workers
+        coro = operation(*args, **kwargs)
+        return {"result": await as_requester(coro, request.get("requester") or peer)}
+    except Exception as e:
+        logger.error(f"Daemon operation '{request['op']}' failed: {e}")
+        return {"error": encode_error(e)}
+
+async def handle_connection(reader, writer):
+    peer = str(writer.get_extra_info('peername') or 'local')
+    try:
+        request = await read_frame(reader)
+        writer.write(encode_frame(await dispatch(request, peer)))
+        await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass # The web worker went away; its operation has already finished or failed
+    except Exception as e:
+        logger.error(f"Malformed daemon request from {peer}: {e}")
+    finally:
+        writer.close()
+
+async def start_server(address):
+    kind, target = parse_address(address)
+    if kind == "unix":
+        if os.path.exists(target): os.remove(target) # Stale socket from a previous run
+        server = await asyncio.start_unix_server(handle_connection, path=target)
+        os.chmod(target, 0o660)
+    else:
+        # Any local process can reach a TCP port, so the token is the only thing guarding it
+        if not DAEMON_TOKEN: raise RuntimeError("daemon_token must be set to listen on TCP; set it or use a unix: socket address.")
+        server = await asyncio.start_server(handle_connection, *target)
+    logger.info(f"Transfer daemon listening on {address}")
+    return server
+
+async def main():
+    async with bot:
+        server = await start_server(TRANSFER_DAEMON or DEFAULT_DAEMON_ADDRESS)
+        async with server:
+            await bot.start(TOKEN)
+
+# --- Main Execution ---
+if __name__ == '__main__':
+    asyncio.run(main())
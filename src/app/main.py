@@ -9,25 +9,46 @@ if __name__ == "__main__" and __package__ is None:
     sys.path.append(root_dir)
     __package__ = "src.app"
 
-from flask import Flask, request, render_template, send_file, redirect, url_for, flash, jsonify, after_this_request
-import threading, json, asyncio, uuid, shutil, os
+from flask import Flask, request, render_template, send_file, redirect, url_for, flash, jsonify, after_this_request, g, abort
+import threading, uuid
 from dotenv import load_dotenv
 from ..dis_commands import bot
 from ..utils.util import (
     logger,
-    cipher,
     DATA_DIRECTORY,
+    file_digest,
     find_guild_by_name,
     fetch_channels_from_guild,
     process_and_chunk_file,
+    write_handoff,
+    read_handoff,
 )
 from ..utils.file_ops import (
     upload_single_file,
     upload_folder,
     download_from_discord,
     delete_from_discord,
-    fetch_files_from_channel
+    list_files_page,
+    cleanup_download,
+    rotate_channel_keys,
+    load_folder_manifest,
+    retire_folder_version,
+    resume_upload,
+    verify_object,
 )
+from ..utils.rpc import TRANSFER_DAEMON, TransferLost, call_daemon
+from ..utils.manifest import iter_tree_files
+from ..utils.envelope import ObjectKey
+from ..utils.journal import UploadInterrupted, incomplete_journals
+from ..utils.profiling import (
+    ProfileSession,
+    is_admin,
+    wants_profile,
+    run_threadsafe,
+    recent_profiles,
+    profile_file_path,
+)
+from ..utils.scheduler import as_requester, scheduler_snapshot
 
 # load details from env
 load_dotenv()
@@ -38,7 +59,8 @@ template_dir = os.path.join(base_dir, 'templates')
 static_dir = os.path.join(base_dir, 'static')
 
 app = Flask(__name__, template_folder=template_dir, static_folder=static_dir)
-app.secret_key = os.urandom(24) 
+# Shared across web workers when several run behind a load balancer
+app.secret_key = os.getenv("flask_secret_key") or os.urandom(24)
 
 # bot token
 TOKEN = os.getenv("bot_token")
@@ -47,6 +69,38 @@ TOKEN = os.getenv("bot_token")
 async def on_ready():
     logger.info(f'Logged in as {bot.user}')
 
+def run_on_bot(func, *args, **kwargs):
+    """
+    Runs a transfer operation and blocks until it returns: on the transfer daemon when
+    transfer_daemon is set, otherwise on this process's bot loop (profiled if requested).
+    """
+    # Discord calls are queued per requester so one client's bulk work can't starve others
+    if TRANSFER_DAEMON:
+        return call_daemon(func.__name__, *args, requester=request.remote_addr, **kwargs)
+    return run_threadsafe(as_requester(func(*args, **kwargs), request.remote_addr), bot.loop, g.get('profile_session'))
+
+# --- Request Profiling ---
+@app.before_request
+def start_profiling():
+    if wants_profile(request.headers, request.args):
+        session = ProfileSession(f"{request.method} {request.path}")
+        if not session.start():
+            return jsonify({"error": "Another request is being profiled; try again when it finishes."}), 409
+        g.profile_session = session
+
+@app.after_request
+def finish_profiling(response):
+    session = g.pop('profile_session', None)
+    if session is not None:
+        response.headers['X-Profile-Name'] = session.finish()
+    return response
+
+@app.teardown_request
+def abort_profiling(error=None):
+    # Handler raised before after_request could run; still save what was captured
+    session = g.pop('profile_session', None)
+    if session is not None: session.finish()
+
 # --- Flask Routes ---
 @app.route('/')
 def index():
@@ -60,8 +114,7 @@ def select_server():
         return redirect(url_for('index'))
 
     # Find the guild by name to get its ID
-    future = asyncio.run_coroutine_threadsafe(find_guild_by_name(server_name), bot.loop)
-    server_id = future.result()
+    server_id = run_on_bot(find_guild_by_name, server_name)
 
     if server_id:
         # Redirect to the main page using the found server ID
@@ -73,8 +126,7 @@ def select_server():
 @app.route('/server/<server_id>')
 def server_page(server_id):
     # Fetch server name and channel list from the bot
-    future = asyncio.run_coroutine_threadsafe(fetch_channels_from_guild(server_id), bot.loop)
-    server_data = future.result()
+    server_data = run_on_bot(fetch_channels_from_guild, server_id)
 
     if server_data:
         return render_template(
@@ -95,6 +147,8 @@ def upload_handler():
     channel_name = request.form.get('channel')
     secure_upload = request.form.get('encrypt') == 'true'
     custom_folder_name = request.form.get('folder_name')
+    sync_upload = request.form.get('sync') == 'true'
+    prune_upload = request.form.get('prune') == 'true'
     files = request.files.getlist('files[]')
 
     if not all([server_id, channel_name, files]):
@@ -109,46 +163,113 @@ def upload_handler():
         # Use custom folder name if provided, otherwise use directory from first file
         folder_name = custom_folder_name or os.path.dirname(files[0].filename) or "upload"
 
+        # Sync mode: compare against the folder's current version and only upload changes
+        previous = run_on_bot(load_folder_manifest, server_id, channel_name, folder_name) if sync_upload else None
+        previous_tree = read_handoff(previous["tree_path"]) if previous else {}
+        if previous and previous["metadata"].get("encrypted", False) != secure_upload:
+            logger.warning(f"Encryption setting changed for '{folder_name}'; re-uploading every file.")
+            previous_files = {}
+        elif previous and secure_upload and previous["object_key"] is None:
+            logger.warning(f"'{folder_name}' predates per-object keys; re-uploading every file.")
+            previous_files = {}
+        else:
+            previous_files = dict(iter_tree_files(previous_tree))
+
+        # One data key per folder object; it is wrapped by the master key in the metadata.
+        # A synced version keeps its predecessor's key so unchanged chunks stay readable.
+        if previous and previous_files and previous["object_key"]:
+            object_key = previous["object_key"].rewrapped()
+        else:
+            object_key = ObjectKey.generate() if secure_upload else None
+
         for file in files:
             if not file.filename: continue
             
             temp_file_path = os.path.join(DATA_DIRECTORY, f"{uuid.uuid4()}{os.path.splitext(file.filename)[1]}")
             file.save(temp_file_path)
 
-            # Use the unified helper for processing
-            processed_chunks, processed_basenames = process_and_chunk_file(temp_file_path, secure_upload)
-            all_chunk_paths.extend(processed_chunks)
-
-            # Build the folder tree structure
+            # Build the folder tree structure; chunks are filled in below
             path_parts = file.filename.split('/')
             current_level = folder_tree
             for part in path_parts[:-1]:
                 current_level = current_level.setdefault(part, {"type": "directory", "children": {}})["children"]
-            current_level[path_parts[-1]] = {"type": "file", "chunks": processed_basenames}
+            current_level[path_parts[-1]] = {
+                "type": "file",
+                "size": os.path.getsize(temp_file_path),
+                "sha256": file_digest(temp_file_path),
+                "source": temp_file_path,
+            }
+
+        tree = folder_tree.get(folder_name, {}).get("children", folder_tree)
+        reused_count = uploaded_count = 0
+        for path, entry in iter_tree_files(tree):
+            temp_file_path = entry.pop("source")
+            previous_entry = previous_files.get(path)
+            if previous_entry and (previous_entry.get("size"), previous_entry.get("sha256")) == (entry["size"], entry["sha256"]):
+                # Unchanged since the previous version: reuse its chunk references
+                entry["chunks"] = previous_entry["chunks"]
+                if "chunk_sizes" in previous_entry: entry["chunk_sizes"] = previous_entry["chunk_sizes"]
+                os.remove(temp_file_path)
+                reused_count += 1
+                continue
+
+            # Use the unified helper for processing
+            processed_chunks, processed_basenames = process_and_chunk_file(temp_file_path, secure_upload, object_key.cipher if object_key else None)
+            all_chunk_paths.extend(processed_chunks)
+            entry["chunks"] = processed_basenames
+            entry["chunk_sizes"] = [os.path.getsize(chunk_path) for chunk_path in processed_chunks]
+            uploaded_count += 1
 
         final_metadata = {
             "upload_type": "folder", 
             "folder_name": folder_name, 
             "encrypted": secure_upload,
-            "total_size": sum(os.path.getsize(p) for p in all_chunk_paths), # calc size of all chunks
-            "tree": folder_tree.get(folder_name, {}).get("children", folder_tree)
+            "total_size": sum(entry["size"] for _, entry in iter_tree_files(tree)), # original size of all files
+            "tree": tree
         }
+        if previous:
+            final_metadata["version"] = previous["metadata"].get("version", 1) + 1
+            if previous_files and "replica_channels" in previous["metadata"]:
+                final_metadata["replica_channels"] = previous["metadata"]["replica_channels"]
         
+        # The tree and chunk list go through a file, as they can be far larger than an RPC frame
+        upload_path = write_handoff({"metadata": final_metadata, "chunks": [os.path.basename(path) for path in all_chunk_paths]})
         try:
-            future = asyncio.run_coroutine_threadsafe(upload_folder(final_metadata, all_chunk_paths, server_id, channel_name), bot.loop)
-            future.result()
+            supersedes = previous["message_ids"] if previous else ()
+            run_on_bot(upload_folder, upload_path, server_id, channel_name, object_key, supersedes)
+        except UploadInterrupted as e:
+            # Unsent chunks stay on disk so the upload can be resumed
+            return jsonify({"status": "error", "message": f"Folder upload interrupted: {e}", "upload_id": e.upload_id}), 500
+        except TransferLost as e:
+            # The daemon may still be sending these chunks; its journal cleans them up once it is done
+            logger.error(f"Lost track of folder upload '{folder_name}': {e}")
+            return jsonify({"status": "error", "message": f"Folder upload interrupted: {e}. It may still finish; check /uploads/incomplete to resume it if not."}), 500
         except Exception as e:
             logger.error(f"Error uploading folder '{folder_name}': {e}")
             # Clean up any remaining chunk files
-            for chunk_path in all_chunk_paths:
+            for chunk_path in [upload_path, *all_chunk_paths]:
                 if os.path.exists(chunk_path):
                     os.remove(chunk_path)
             return jsonify({"status": "error", "message": f"Folder upload failed: {str(e)}"}), 500
+
+        if previous:
+            # The new version is in place; retire the old manifest (and optionally its orphaned chunks)
+            stale_chunks_path = None
+            if prune_upload:
+                referenced = {chunk for _, entry in iter_tree_files(tree) for chunk in entry["chunks"]}
+                previous_chunks = {chunk for _, entry in iter_tree_files(previous_tree) for chunk in entry.get("chunks", [])}
+                stale_chunks_path = write_handoff(sorted(previous_chunks - referenced))
+            pruned = run_on_bot(retire_folder_version, server_id, channel_name, previous, stale_chunks_path)
+            return jsonify({
+                "status": "success",
+                "message": f"Folder '{folder_name}' synced: {uploaded_count} changed, {reused_count} unchanged, {pruned} old chunks pruned."
+            })
         
         return jsonify({"status": "success", "message": f"Folder '{folder_name}' uploaded."})
 
     else:
         logger.info("Individual file upload detected.")
+        interrupted = []
         for file in files:
             if not file.filename: continue
             
@@ -158,12 +279,15 @@ def upload_handler():
 
             try:
                 logger.info(f"Uploading file '{file.filename}' to channel '{channel_name}'...")
-                future = asyncio.run_coroutine_threadsafe(
-                    upload_single_file(temp_file_path, file.filename, server_id, channel_name, secure_upload),
-                    bot.loop
-                )
-                future.result()
+                run_on_bot(upload_single_file, temp_file_path, file.filename, server_id, channel_name, secure_upload)
                 logger.info(f"File '{file.filename}' uploaded successfully.")
+            except UploadInterrupted as e:
+                interrupted.append({"filename": file.filename, "upload_id": e.upload_id})
+            except TransferLost as e:
+                # The daemon may still be reading the file; leave it to the daemon and its journal
+                logger.error(f"Lost track of upload '{file.filename}': {e}")
+                interrupted.append({"filename": file.filename, "upload_id": None})
+                temp_file_path = None
             except Exception as e:
                 logger.error(f"Error uploading file '{file.filename}': {e}")
                 # Ensure cleanup if upload fails
@@ -171,10 +295,37 @@ def upload_handler():
                     os.remove(temp_file_path)
             finally:
                 # Final cleanup check for temp file
-                if os.path.exists(temp_file_path):
+                if temp_file_path and os.path.exists(temp_file_path):
                     os.remove(temp_file_path)
+        if interrupted:
+            return jsonify({
+                "status": "error",
+                "message": f"{len(interrupted)} of {len(files)} uploads were interrupted; any that do not finish on their own can be resumed from /uploads/incomplete.",
+                "interrupted": interrupted,
+            }), 500
         return jsonify({"status": "success", "message": f"{len(files)} files uploaded."})
 
+@app.route('/uploads/incomplete', methods=['GET'])
+def incomplete_uploads_route():
+    server_id = request.args.get('server_id')
+    uploads = [journal.summary() for journal in incomplete_journals()]
+    if server_id: uploads = [upload for upload in uploads if upload["server_id"] == server_id]
+    return jsonify({"uploads": uploads})
+
+@app.route('/uploads/resume', methods=['POST'])
+def resume_upload_route():
+    upload_id = request.get_json().get('upload_id')
+    if not upload_id:
+        return jsonify({"status": "error", "message": "Missing upload_id"}), 400
+
+    try:
+        summary = run_on_bot(resume_upload, upload_id)
+    except UploadInterrupted as e:
+        return jsonify({"status": "error", "message": str(e), "upload_id": e.upload_id}), 500
+    if summary is None:
+        return jsonify({"status": "error", "message": f"No incomplete upload with id '{upload_id}', or it is still being sent"}), 404
+    return jsonify({"status": "success", "message": f"Upload of '{summary['object_name']}' resumed and completed.", "upload": summary})
+
 # --- File Listing Logic ---
 @app.route('/list_files', methods=['POST'])
 def list_files_route():
@@ -185,10 +336,24 @@ def list_files_route():
     if not server_id or not channel_name:
         return jsonify({"error": "Missing server_id or channel_name"}), 400
 
-    future = asyncio.run_coroutine_threadsafe(fetch_files_from_channel(server_id, channel_name), bot.loop)
-    files = future.result()
+    # Server-side filtering, sorting and cursor pagination; only the page is returned
+    try:
+        result = run_on_bot(
+            list_files_page, server_id, channel_name,
+            refresh=bool(data.get('refresh')),
+            sort=data.get('sort', 'date'),
+            order=data.get('order', 'desc'),
+            prefix=data.get('prefix', ''),
+            search=data.get('search', ''),
+            file_type=data.get('type') or None,
+            encrypted=data.get('encrypted'),
+            cursor=data.get('cursor'),
+            limit=data.get('limit'),
+        )
+    except ValueError:
+        return jsonify({"error": "Invalid cursor, limit or filter"}), 400
     
-    return jsonify({"files": files})
+    return jsonify(result)
 
 # --- Download Logic ---
 @app.route('/download', methods=['POST'])
@@ -197,14 +362,13 @@ def download_route():
     filename = request.form.get('files')
     channel_name = request.form.get('channels') 
     logger.info(f"Download for '{filename}' from server '{server_id}' in channel '{channel_name}'")
-    future = asyncio.run_coroutine_threadsafe(download_from_discord(server_id, channel_name, filename), bot.loop)
-    file_path = future.result() 
+    file_path = run_on_bot(download_from_discord, server_id, channel_name, filename)
 
     if file_path and os.path.exists(file_path):
         @after_this_request
         def remove_file(response):
             try:
-                os.remove(file_path)
+                cleanup_download(file_path)
                 logger.info(f"Removed temporary file after download: {file_path}")
             except Exception as error:
                 logger.error(f"Error removing file: {error}")
@@ -229,8 +393,7 @@ def delete_route():
     logger.info(f"Delete request for '{filename}' from server '{server_id}' in channel '{channel_name}'")
     
     try:
-        future = asyncio.run_coroutine_threadsafe(delete_from_discord(server_id, channel_name, filename), bot.loop)
-        success = future.result()
+        success = run_on_bot(delete_from_discord, server_id, channel_name, filename)
         
         if success:
             return jsonify({"status": "success", "message": f"Successfully deleted '{filename}'."})
@@ -240,10 +403,66 @@ def delete_route():
         logger.error(f"Error in delete route: {e}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
+# --- Verify & Repair Logic ---
+@app.route('/verify', methods=['POST'])
+def verify_route():
+    data = request.get_json()
+    server_id = data.get('server_id')
+    filename = data.get('filename')
+    channel_name = data.get('channel_name')
+    if not all([server_id, filename, channel_name]):
+        return jsonify({"status": "error", "message": "Missing required fields"}), 400
+
+    logger.info(f"Verify request for '{filename}' (repair={bool(data.get('repair'))}) in channel '{channel_name}'")
+    try:
+        report = run_on_bot(verify_object, server_id, channel_name, filename, repair=bool(data.get('repair')))
+    except Exception as e:
+        logger.error(f"Error in verify route: {e}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+    if report is None:
+        return jsonify({"status": "error", "message": f"'{filename}' not found"}), 404
+    return jsonify({"status": "success", "report": report})
+
+# --- Admin Logic ---
+@app.route('/admin/profiles', methods=['GET'])
+def list_profiles_route():
+    if not is_admin(request.headers): abort(403)
+    return jsonify({"profiles": recent_profiles()})
+
+@app.route('/admin/profiles/<name>/<kind>', methods=['GET'])
+def get_profile_route(name, kind):
+    if not is_admin(request.headers): abort(403)
+    path = profile_file_path(name, kind)
+    if not path: abort(404)
+    return send_file(path, as_attachment=True, download_name=os.path.basename(path))
+
+@app.route('/admin/scheduler', methods=['GET'])
+def scheduler_status_route():
+    if not is_admin(request.headers): abort(403)
+    return jsonify(run_on_bot(scheduler_snapshot))
+
+@app.route('/admin/rotate_keys', methods=['POST'])
+def rotate_keys_route():
+    if not is_admin(request.headers): abort(403)
+    data = request.get_json()
+    server_id = data.get('server_id')
+    channel_name = data.get('channel_name')
+    if not server_id or not channel_name:
+        return jsonify({"status": "error", "message": "Missing server_id or channel_name"}), 400
+
+    summary = run_on_bot(rotate_channel_keys, server_id, channel_name)
+    if summary is None:
+        return jsonify({"status": "error", "message": "Server or channel not found"}), 404
+    return jsonify({"status": "success", "summary": summary})
+
 # --- Main Execution ---
 def run_flask():
     app.run(use_reloader=False, port=5000, host="0.0.0.0")
 
 if __name__ == '__main__':
-    threading.Thread(target=run_flask, daemon=True).start()
-    bot.run(TOKEN)
\ No newline at end of file
+    if TRANSFER_DAEMON:
+        # Transfers run in src/app/daemon.py; this process only serves the web tier
+        run_flask()
+    else:
+        threading.Thread(target=run_flask, daemon=True).start()
+        bot.run(TOKEN)
\ No newline at end of file
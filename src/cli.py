@@ -0,0 +1,458 @@
+import argparse, asyncio, json, logging, math, os, shutil, sys, uuid
+import urllib.error, urllib.parse, urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+# Headless bulk-transfer client. Run from the project root:
+#   python -m src.cli upload PATH... --server S --channel C [--encrypt] [-j N] [--dry-run]
+#   python -m src.cli download NAME... --server S --channel C [-o DIR] [-j N]
+#   python -m src.cli list --server S --channel C [--search TEXT]
+#   python -m src.cli resume [UPLOAD_ID]
+# With --url (or api_url) it talks to a running web server. Without it, it logs in
+# directly with bot_token and uses the same chunking, encryption and metadata format.
+load_dotenv()
+
+API_URL = os.getenv("api_url", "")
+DEFAULT_PARALLEL = 4
+BLOCK_SIZE = 1024 * 1024 # Streaming block size for web uploads and downloads
+
+
+class TransferFailed(Exception):
+    """A transfer the CLI could not complete; reported without a traceback."""
+
+def resume_hint(upload_id):
+    return f"Resume with: python -m src.cli resume {upload_id}"
+
+# --- Progress Output ---
+def report(message):
+    print(message, file=sys.stderr, flush=True)
+
+def human_size(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024: return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+def progress_printer(label):
+    """Returns a progress(done, total, name) callback that prints one line per step."""
+    def progress(done, total, name):
+        report(f"[{label}] {done}/{total} {name}")
+    return progress
+
+# --- Local Files ---
+def walk_files(path):
+    """Yields (relative path using '/', absolute path) for every file under a directory."""
+    for root, dirs, names in os.walk(path):
+        dirs.sort()
+        for name in sorted(names):
+            full_path = os.path.join(root, name)
+            yield os.path.relpath(full_path, path).replace(os.sep, '/'), full_path
+
+def object_name(path, name=None):
+    return name or os.path.basename(os.path.normpath(path))
+
+def fernet_size(size):
+    """Size of the Fernet token produced for a payload of the given size."""
+    raw = 1 + 8 + 16 + 16 * (size // 16 + 1) + 32 # version, timestamp, IV, padded ciphertext, HMAC
+    return 4 * math.ceil(raw / 3)
+
+def estimate(paths, encrypt):
+    """Counts what an upload would store without touching Discord (or the local files)."""
+    from .utils.util import CHUNK_SIZE
+    totals = {"objects": 0, "files": 0, "bytes": 0, "stored_bytes": 0, "chunks": 0}
+    for path in paths:
+        files = [full_path for _, full_path in walk_files(path)] if os.path.isdir(path) else [path]
+        totals["objects"] += 1
+        for full_path in files:
+            size = os.path.getsize(full_path)
+            stored = fernet_size(size) if encrypt else size
+            totals["files"] += 1
+            totals["bytes"] += size
+            totals["stored_bytes"] += stored
+            totals["chunks"] += max(1, math.ceil(stored / CHUNK_SIZE))
+    return totals
+
+# --- Web API Client ---
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # The web UI answers failures with a redirect; the CLI wants to see them
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+def _multipart(fields, files):
+    """
+    Builds a streamed multipart/form-data body so large trees are never held in memory.
+    files: [(field, filename, local path)]. Returns (content type, length, block iterator).
+    """
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append((f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode(), None))
+    for field, filename, path in files:
+        filename = filename.replace('"', '%22')
+        header = (f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+                  'Content-Type: application/octet-stream\r\n\r\n')
+        parts.append((header.encode(), path))
+        parts.append((b'\r\n', None))
+    tail = f'--{boundary}--\r\n'.encode()
+    length = sum(len(data) + (os.path.getsize(path) if path else 0) for data, path in parts) + len(tail)
+
+    def body():
+        for data, path in parts:
+            yield data
+            if path:
+                with open(path, 'rb') as f:
+                    yield from iter(lambda: f.read(BLOCK_SIZE), b'')
+        yield tail
+    return f"multipart/form-data; boundary={boundary}", length, body()
+
+def _counted(blocks, total, label):
+    """Passes blocks through, reporting progress in roughly 5% steps."""
+    step = max(total // 20, BLOCK_SIZE)
+    sent, next_report = 0, min(step, total)
+    for block in blocks:
+        yield block
+        sent += len(block)
+        if sent >= next_report:
+            report(f"[{label}] {human_size(sent)} of {human_size(total)} sent")
+            next_report = min(sent + step, total)
+
+def _attachment_name(headers):
+    # Flask sends non-ASCII names as filename*=UTF-8''..., which get_filename() doesn't prefer
+    disposition = headers.get("Content-Disposition", "")
+    marker = "filename*=UTF-8''"
+    if marker in disposition: return urllib.parse.unquote(disposition.split(marker, 1)[1].split(';', 1)[0])
+    return headers.get_filename()
+
+
+class WebClient:
+    """Drives the web server's HTTP API."""
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        self.opener = urllib.request.build_opener(_NoRedirect)
+
+    def _open(self, path, data=None, headers=None):
+        request = urllib.request.Request(f"{self.url}{path}", data=data, headers=headers or {})
+        try:
+            return self.opener.open(request)
+        except urllib.error.HTTPError as e:
+            if e.code in (301, 302, 303): return e # Redirects are answers too (see _NoRedirect)
+            try:
+                body = json.loads(e.read())
+            except ValueError:
+                raise TransferFailed(f"{path} failed with HTTP {e.code}") from None
+            # Each upload request carries a single object, so there is at most one id to resume
+            upload_id = body.get("upload_id") or next((item["upload_id"] for item in body.get("interrupted", [])), None)
+            if upload_id:
+                raise TransferFailed(f"{body.get('message')} {resume_hint(upload_id)}") from None
+            raise TransferFailed(body.get("message") or body.get("error") or f"HTTP {e.code}") from None
+
+    def _json(self, path, payload=None):
+        data = json.dumps(payload).encode() if payload is not None else None
+        with self._open(path, data, {"Content-Type": "application/json"} if data else {}) as response:
+            return json.loads(response.read())
+
+    def resolve_server(self, server):
+        if server.isdigit(): return server
+        data = urllib.parse.urlencode({"server_name": server}).encode()
+        with self._open("/select_server", data) as response:
+            location = response.headers.get("Location", "")
+        if "/server/" not in location: raise TransferFailed(f"Server '{server}' not found.")
+        return location.rstrip('/').rsplit('/', 1)[-1]
+
+    def upload(self, path, server_id, channel, encrypt, name=None, sync=False, prune=False):
+        name = object_name(path, name)
+        fields = {"server_id": server_id, "channel": channel, "encrypt": "true" if encrypt else "false"}
+        if os.path.isdir(path):
+            fields.update({"folder_name": name, "sync": "true" if sync else "false", "prune": "true" if prune else "false"})
+            files = [("files[]", f"{name}/{relative_path}", full_path) for relative_path, full_path in walk_files(path)]
+            if not files: raise TransferFailed(f"'{path}' contains no files.")
+        else:
+            files = [("files[]", name, path)]
+        content_type, length, body = _multipart(fields, files)
+        headers = {"Content-Type": content_type, "Content-Length": str(length)}
+        with self._open("/upload", _counted(body, length, name), headers) as response:
+            return json.loads(response.read()).get("message")
+
+    def download(self, name, server_id, channel, output):
+        # The web API serves a whole folder as a single ZIP, so there is nothing to parallelize or resume per file
+        data = urllib.parse.urlencode({"server_id": server_id, "files": name, "channels": channel}).encode()
+        with self._open("/download", data) as response:
+            if response.status != 200: raise TransferFailed(f"'{name}' not found or failed to download.")
+            filename = os.path.basename(_attachment_name(response.headers) or name.rstrip('/').split('/')[-1])
+            target = os.path.join(output, filename)
+            with open(f"{target}.part", 'wb') as f:
+                shutil.copyfileobj(response, f, BLOCK_SIZE)
+        os.replace(f"{target}.part", target)
+        return f"saved to {target}"
+
+    def list(self, server_id, channel, search=""):
+        files, cursor = [], None
+        while True:
+            page = self._json("/list_files", {"server_id": server_id, "channel_name": channel, "search": search,
+                                              "sort": "name", "order": "asc", "cursor": cursor, "limit": 500})
+            files.extend(page["files"])
+            cursor = page.get("next_cursor")
+            if not cursor: return files
+
+    def incomplete(self):
+        return self._json("/uploads/incomplete")["uploads"]
+
+    def resume(self, upload_id):
+        return self._json("/uploads/resume", {"upload_id": upload_id})["message"]
+
+# --- Direct (Bot Token) Client ---
+class DirectClient:
+    """Talks to Discord through file_ops with this process's own bot login."""
+    def __init__(self, parallel):
+        self.parallel = max(1, parallel)
+
+    async def resolve_server(self, server):
+        from .utils.util import find_guild_by_name
+        server_id = server if server.isdigit() else await find_guild_by_name(server)
+        if not server_id: raise TransferFailed(f"Server '{server}' not found.")
+        return str(server_id)
+
+    def _check_channel(self, server_id, channel):
+        import discord
+        from .dis_commands import bot
+        guild = bot.get_guild(int(server_id))
+        if not guild or not discord.utils.get(guild.text_channels, name=channel):
+            raise TransferFailed(f"Channel '{channel}' not found in server {server_id}.")
+
+    def _stage(self, path):
+        """Copies a file into the data directory; processing encrypts and renames it in place."""
+        from .utils.util import DATA_DIRECTORY
+        staged_path = os.path.join(DATA_DIRECTORY, f"{uuid.uuid4()}{os.path.splitext(path)[1]}")
+        shutil.copyfile(path, staged_path)
+        return staged_path
+
+    async def upload(self, path, server_id, channel, encrypt, name=None, sync=False, prune=False):
+        from .utils.file_ops import upload_single_file
+        from .utils.journal import UploadInterrupted
+        if sync or prune: raise TransferFailed("--sync and --prune need --url (web mode).")
+        self._check_channel(server_id, channel)
+        name = object_name(path, name)
+        try:
+            if os.path.isdir(path): return await self._upload_folder(path, server_id, channel, encrypt, name)
+            await upload_single_file(await asyncio.to_thread(self._stage, path), name, server_id, channel, encrypt, progress=progress_printer(name))
+        except UploadInterrupted as e:
+            raise TransferFailed(f"{e} {resume_hint(e.upload_id)}") from None
+        return f"'{name}' uploaded."
+
+    async def _upload_folder(self, path, server_id, channel, encrypt, name):
+        from .utils.file_ops import upload_folder_files
+        files = list(walk_files(path))
+        if not files: raise TransferFailed(f"'{path}' contains no files.")
+        # Files are chunked (and encrypted) a bounded window ahead of the upload, off the bot loop
+        report(f"[{name}] uploading {len(files)} files" + (" (encrypted)..." if encrypt else "..."))
+        await upload_folder_files(files, name, server_id, channel, encrypt, self.parallel, progress=progress_printer(name))
+        return f"Folder '{name}' uploaded ({len(files)} files)."
+
+    async def download(self, name, server_id, channel, output):
+        from .utils.file_ops import download_from_discord, download_tree, cleanup_download
+        self._check_channel(server_id, channel)
+        if '/' in name.rstrip('/'):
+            # A single path inside a folder
+            file_path = await download_from_discord(server_id, channel, name)
+            if not file_path: raise TransferFailed(f"'{name}' not found or failed to download.")
+            target = os.path.join(output, os.path.basename(file_path))
+            # Multi-GB copies run off the bot loop so heartbeats and other transfers keep going
+            await asyncio.to_thread(shutil.copyfile, file_path, target)
+            cleanup_download(file_path)
+            return f"saved to {target}"
+
+        summary = await download_tree(server_id, channel, name, output, self.parallel, progress_printer(name))
+        if summary is None: raise TransferFailed(f"'{name}' not found.")
+        if summary["failed"]: raise TransferFailed(f"{summary['failed']} file(s) of '{name}' failed; run the download again to retry them.")
+        return f"{summary['downloaded']} downloaded, {summary['skipped']} already up to date."
+
+    async def list(self, server_id, channel, search=""):
+        from .utils.file_ops import fetch_files_from_channel
+        from .utils.listing import query_files, MAX_PAGE_SIZE
+        self._check_channel(server_id, channel)
+        files, cursor = [], None
+        all_files = await fetch_files_from_channel(server_id, channel)
+        while True:
+            page = query_files(all_files, sort="name", order="asc", search=search, cursor=cursor, limit=MAX_PAGE_SIZE)
+            files.extend(page["files"])
+            cursor = page["next_cursor"]
+            if not cursor: return files
+
+    async def incomplete(self):
+        from .utils.journal import incomplete_journals
+        return [journal.summary() for journal in incomplete_journals()]
+
+    async def resume(self, upload_id):
+        from .utils.file_ops import resume_upload
+        from .utils.journal import UploadInterrupted
+        try:
+            summary = await resume_upload(upload_id, progress=progress_printer(upload_id))
+        except UploadInterrupted as e:
+            raise TransferFailed(f"{e} {resume_hint(e.upload_id)}") from None
+        if summary is None: raise TransferFailed(f"No incomplete upload with id '{upload_id}', or it is still being sent.")
+        return f"Upload of '{summary['object_name']}' resumed and completed."
+
+# --- Commands ---
+def print_listing(files):
+    from .utils.listing import entry_name, entry_size, entry_type
+    for metadata in files:
+        lock = "E" if metadata.get("encrypted") else "-"
+        print(f"{entry_type(metadata):<6} {lock} {human_size(entry_size(metadata)):>10}  {metadata.get('upload_date', ''):<19}  {entry_name(metadata)}")
+
+def print_incomplete(uploads):
+    if not uploads: return report("No incomplete uploads.")
+    for upload in uploads:
+        print(f"{upload['upload_id']}  {upload['sent']}/{upload['total']}  {upload['created']}  {upload['channel_name']}/{upload['object_name']}")
+
+def print_estimate(args):
+    totals = estimate(args.paths, args.encrypt)
+    print(f"{totals['objects']} object(s), {totals['files']} file(s), {human_size(totals['bytes'])}")
+    print(f"-> {totals['chunks']} chunk(s), {human_size(totals['stored_bytes'])} stored"
+          + (" (encrypted)" if args.encrypt else "") + ", plus one metadata message per object")
+
+def _outcome(label, result):
+    """Prints one target's result; returns True if it succeeded."""
+    if isinstance(result, TransferFailed):
+        report(f"[{label}] FAILED: {result}")
+        return False
+    if isinstance(result, BaseException): raise result
+    report(f"[{label}] {result}")
+    return True
+
+def run_web(args):
+    client = WebClient(args.url)
+    if args.command == "resume":
+        if not args.upload_id: return print_incomplete(client.incomplete()) or 0
+        report(client.resume(args.upload_id))
+        return 0
+
+    server_id = client.resolve_server(args.server)
+    if args.command == "list":
+        print_listing(client.list(server_id, args.channel, args.search))
+        return 0
+
+    def attempt(func, *call_args):
+        try:
+            return func(*call_args)
+        except TransferFailed as e:
+            return e
+
+    if args.command == "upload":
+        calls = [(client.upload, path, server_id, args.channel, args.encrypt, args.name, args.sync, args.prune) for path in args.paths]
+        labels = [object_name(path, args.name) for path in args.paths]
+    else:
+        calls = [(client.download, name, server_id, args.channel, args.output) for name in args.names]
+        labels = args.names
+    # Each object is one request; -j of them run at once
+    with ThreadPoolExecutor(max(1, args.parallel)) as pool:
+        results = list(pool.map(lambda call: attempt(*call), calls))
+    return 0 if all([_outcome(label, result) for label, result in zip(labels, results)]) else 1
+
+def run_direct(args):
+    from .dis_commands import bot
+    # The shared logger is very chatty; keep the terminal for progress unless asked
+    logging.getLogger().setLevel(logging.DEBUG if args.verbose else logging.WARNING)
+    client = DirectClient(args.parallel)
+
+    async def operate():
+        if args.command == "resume":
+            if not args.upload_id: return print_incomplete(await client.incomplete()) or 0
+            report(await client.resume(args.upload_id))
+            return 0
+
+        server_id = await client.resolve_server(args.server)
+        if args.command == "list":
+            print_listing(await client.list(server_id, args.channel, args.search))
+            return 0
+        if args.command == "upload":
+            calls = [(client.upload, path, server_id, args.channel, args.encrypt, args.name, args.sync, args.prune) for path in args.paths]
+            labels = [object_name(path, args.name) for path in args.paths]
+        else:
+            calls = [(client.download, name, server_id, args.channel, args.output) for name in args.names]
+            labels = args.names
+
+        # -j objects at once, and -j files at once within each folder
+        semaphore = asyncio.Semaphore(max(1, args.parallel))
+        async def attempt(func, *call_args):
+            async with semaphore:
+                try:
+                    return await func(*call_args)
+                except TransferFailed as e:
+                    return e
+        results = await asyncio.gather(*(attempt(*call) for call in calls))
+        return 0 if all([_outcome(label, result) for label, result in zip(labels, results)]) else 1
+
+    async def main():
+        token = os.getenv("bot_token")
+        if not token: raise TransferFailed("bot_token is not set; pass --url to use the web API instead.")
+        async with bot:
+            login = asyncio.create_task(bot.start(token))
+            ready = asyncio.create_task(bot.wait_until_ready())
+            await asyncio.wait({login, ready}, return_when=asyncio.FIRST_COMPLETED)
+            if not ready.done():
+                ready.cancel()
+                login.result() # Re-raises the login failure
+                raise TransferFailed("The bot disconnected before it was ready.")
+            try:
+                return await operate()
+            finally:
+                await bot.close()
+    return asyncio.run(main())
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m src.cli", description="Bulk transfers to and from Discord storage.")
+    parser.add_argument("--url", default=API_URL, help="web server to use (default: api_url); without it, log in with bot_token")
+    parser.add_argument("-v", "--verbose", action="store_true", help="show the application log (direct mode)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_target(command):
+        command.add_argument("--server", help="server name or ID")
+        command.add_argument("--channel", help="channel name")
+
+    upload = commands.add_parser("upload", help="upload files and folders (folders recursively)")
+    upload.add_argument("paths", nargs="+")
+    add_target(upload)
+    upload.add_argument("--encrypt", action="store_true", help="encrypt with a per-object data key")
+    upload.add_argument("--name", help="object name to store a single path under")
+    upload.add_argument("--sync", action="store_true", help="only upload changed files of an existing folder (web mode)")
+    upload.add_argument("--prune", action="store_true", help="with --sync, delete chunks the new version no longer uses (web mode)")
+    upload.add_argument("-j", "--parallel", type=int, default=DEFAULT_PARALLEL, help="files processed at once")
+    upload.add_argument("--dry-run", action="store_true", help="only estimate total size and chunk count")
+
+    download = commands.add_parser("download", help="download files, folders or paths inside folders",
+                                   description="In web mode (--url) a folder arrives as one ZIP built by the server, without "
+                                               "per-file parallelism or resume; download it in direct mode for both.")
+    download.add_argument("names", nargs="+")
+    add_target(download)
+    download.add_argument("-o", "--output", default=".", help="destination directory")
+    download.add_argument("-j", "--parallel", type=int, default=DEFAULT_PARALLEL, help="files downloaded at once (folders in direct mode)")
+
+    listing = commands.add_parser("list", help="list stored objects")
+    add_target(listing)
+    listing.add_argument("--search", default="", help="only names containing this text")
+
+    resume = commands.add_parser("resume", help="finish an interrupted upload, or list them without an id")
+    resume.add_argument("upload_id", nargs="?")
+    resume.set_defaults(parallel=DEFAULT_PARALLEL)
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == "upload":
+        missing = [path for path in args.paths if not os.path.exists(path)]
+        if missing: parser.error(f"no such file or directory: {', '.join(missing)}")
+        if args.name and len(args.paths) > 1: parser.error("--name needs a single path")
+        if args.dry_run: return print_estimate(args) or 0
+    if args.command == "download": os.makedirs(args.output, exist_ok=True)
+    if args.command != "resume" and not (args.server and args.channel):
+        parser.error("--server and --channel are required")
+
+    try:
+        return run_web(args) if args.url else run_direct(args)
+    except TransferFailed as e:
+        report(f"error: {e}")
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -31,81 +31,139 @@ document.addEventListener('DOMContentLoaded', () => {
     const refreshButton = document.getElementById('refresh-files');
     const downloadForm = document.querySelector('#download-card form');
 
-    const loadFiles = async () => {
-        const channelName = explorerChannelSelect.value;
-        if (!channelName) return;
+    const searchInput = document.getElementById('explorer-search');
+    const sortSelect = document.getElementById('explorer-sort');
+    const typeSelect = document.getElementById('explorer-type');
+    const encryptionSelect = document.getElementById('explorer-encryption');
+    const fileCountLabel = document.getElementById('explorer-count');
+
+    // Virtual list: only rows inside the viewport (plus overscan) exist in the DOM
+    const ROW_HEIGHT = 56;
+    const OVERSCAN = 6;
+    const PAGE_SIZE = 100;
+    let listState = { files: [], nextCursor: null, total: 0, loading: false, channel: null, generation: 0 };
+
+    const escapeHtml = (text) => String(text ?? '').replace(/[&<>"']/g, (c) => ({ '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;' }[c]));
+
+    const buildQuery = () => {
+        const [sort, order] = sortSelect.value.split(':');
+        const encrypted = encryptionSelect.value === '' ? null : encryptionSelect.value === 'true';
+        return { sort, order, search: searchInput.value.trim(), type: typeSelect.value, encrypted };
+    };
 
-        fileListContainer.innerHTML = '<div class="flex items-center justify-center h-full"><i class="fa-solid fa-circle-notch fa-spin text-2xl text-violet-500"></i></div>';
+    const renderRow = (file, index) => {
+        const isFolder = file.upload_type === 'folder';
+        const iconClass = isFolder ? 'fa-folder text-fuchsia-400' : 'fa-file-lines text-violet-400';
+        const size = file.original_size || file.total_size || 0;
+
+        const el = document.createElement('div');
+        el.className = 'file-item grid grid-cols-12 gap-4 px-4 rounded-lg items-center cursor-pointer group absolute left-0 right-0';
+        el.style.top = `${index * ROW_HEIGHT}px`;
+        el.style.height = `${ROW_HEIGHT}px`;
+        el.innerHTML = `
+            <div class="col-span-6 flex items-center gap-3 overflow-hidden">
+                <div class="w-8 h-8 rounded-lg bg-white/5 flex items-center justify-center flex-shrink-0">
+                    <i class="fa-regular ${iconClass}"></i>
+                </div>
+                <div class="truncate">
+                    <div class="text-sm font-medium text-slate-200 truncate group-hover:text-white transition-colors">
+                        ${escapeHtml(file.original_filename || file.folder_name)}
+                    </div>
+                    <div class="text-[10px] text-slate-500 uppercase">${isFolder ? 'Folder' : (file.encrypted ? 'Encrypted' : 'Standard')}</div>
+                </div>
+            </div>
+            <div class="col-span-2 text-right text-xs text-slate-400 font-mono">${formatSize(size)}</div>
+            <div class="col-span-2 text-right text-xs text-slate-400 opacity-70">${formatDate(file.upload_date)}</div>
+            <div class="col-span-2 flex justify-end gap-2">
+                <button class="download-btn p-2 rounded-lg hover:bg-violet-600 text-slate-400 hover:text-white transition-all transform hover:scale-110 active:scale-95" title="Download">
+                    <i class="fa-solid fa-download"></i>
+                </button>
+                <button class="delete-btn p-2 rounded-lg hover:bg-red-600 text-slate-400 hover:text-white transition-all transform hover:scale-110 active:scale-95" title="Delete">
+                    <i class="fa-solid fa-trash"></i>
+                </button>
+            </div>
+        `;
+
+        // Attach Download Event
+        el.querySelector('.download-btn').onclick = (e) => {
+            e.stopPropagation();
+            triggerDownload(file, listState.channel);
+        };
+
+        // Attach Delete Event
+        el.querySelector('.delete-btn').onclick = (e) => {
+            e.stopPropagation();
+            triggerDelete(file, listState.channel);
+        };
+        return el;
+    };
+
+    const renderVisibleRows = () => {
+        const { files, total } = listState;
+        const spacer = fileListContainer.querySelector('.virtual-spacer');
+        if (!spacer || files.length === 0) return;
+
+        // Reserve space for every matching entry so the scrollbar reflects the full listing
+        spacer.style.height = `${Math.max(total, files.length) * ROW_HEIGHT}px`;
 
+        const first = Math.max(0, Math.floor(fileListContainer.scrollTop / ROW_HEIGHT) - OVERSCAN);
+        const last = Math.min(files.length, Math.ceil((fileListContainer.scrollTop + fileListContainer.clientHeight) / ROW_HEIGHT) + OVERSCAN);
+        const fragment = document.createDocumentFragment();
+        for (let i = first; i < last; i++) fragment.appendChild(renderRow(files[i], i));
+        spacer.replaceChildren(fragment);
+
+        // Fetch the next page when the viewport nears the end of what is loaded
+        if (last >= files.length - OVERSCAN && listState.nextCursor && !listState.loading) fetchPage().catch(console.error);
+    };
+
+    const fetchPage = async (refresh = false) => {
+        const generation = listState.generation;
+        listState.loading = true;
         try {
             const response = await fetch('/list_files', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ server_id: SERVER_ID, channel_name: channelName })
+                body: JSON.stringify({
+                    server_id: SERVER_ID,
+                    channel_name: listState.channel,
+                    cursor: listState.nextCursor,
+                    limit: PAGE_SIZE,
+                    refresh,
+                    ...buildQuery()
+                })
             });
             const data = await response.json();
+            if (generation !== listState.generation) return; // A newer query replaced this one
+            if (!response.ok) throw new Error(data.error || 'Failed to load files');
+
+            listState.files.push(...data.files);
+            listState.nextCursor = data.next_cursor;
+            listState.total = data.total;
+            fileCountLabel.textContent = `${data.total} item${data.total === 1 ? '' : 's'}`;
+        } finally {
+            if (generation === listState.generation) listState.loading = false;
+        }
+        renderVisibleRows();
+    };
 
-            fileListContainer.innerHTML = '';
-
-            if (data.files && data.files.length > 0) {
-                data.files.forEach((file, index) => {
-                    const isFolder = file.upload_type === 'folder';
-                    const iconClass = isFolder ? 'fa-folder text-fuchsia-400' : 'fa-file-lines text-violet-400';
-                    const size = file.original_size || file.total_size || 0;
-
-                    const el = document.createElement('div');
-                    el.className = 'file-item grid grid-cols-12 gap-4 px-4 py-3 rounded-lg items-center cursor-pointer group opacity-0';
-                    el.innerHTML = `
-                        <div class="col-span-6 flex items-center gap-3 overflow-hidden">
-                            <div class="w-8 h-8 rounded-lg bg-white/5 flex items-center justify-center flex-shrink-0">
-                                <i class="fa-regular ${iconClass}"></i>
-                            </div>
-                            <div class="truncate">
-                                <div class="text-sm font-medium text-slate-200 truncate group-hover:text-white transition-colors">
-                                    ${file.original_filename || file.folder_name}
-                                </div>
-                                <div class="text-[10px] text-slate-500 uppercase">${isFolder ? 'Folder' : (file.encrypted ? 'Encrypted' : 'Standard')}</div>
-                            </div>
-                        </div>
-                        <div class="col-span-2 text-right text-xs text-slate-400 font-mono">${formatSize(size)}</div>
-                        <div class="col-span-2 text-right text-xs text-slate-400 opacity-70">${formatDate(file.upload_date)}</div>
-                        <div class="col-span-2 flex justify-end gap-2">
-                            <button class="download-btn p-2 rounded-lg hover:bg-violet-600 text-slate-400 hover:text-white transition-all transform hover:scale-110 active:scale-95" title="Download">
-                                <i class="fa-solid fa-download"></i>
-                            </button>
-                            <button class="delete-btn p-2 rounded-lg hover:bg-red-600 text-slate-400 hover:text-white transition-all transform hover:scale-110 active:scale-95" title="Delete">
-                                <i class="fa-solid fa-trash"></i>
-                            </button>
-                        </div>
-                    `;
-
-                    // Attach Download Event
-                    const downloadBtn = el.querySelector('.download-btn');
-                    downloadBtn.onclick = (e) => {
-                        e.stopPropagation();
-                        triggerDownload(file, channelName);
-                    };
-
-                    // Attach Delete Event
-                    const deleteBtn = el.querySelector('.delete-btn');
-                    deleteBtn.onclick = (e) => {
-                        e.stopPropagation();
-                        triggerDelete(file, channelName);
-                    };
-
-                    fileListContainer.appendChild(el);
-                });
-
-                // Staggered Animation for list items
-                anime({
-                    targets: '.file-item',
-                    opacity: [0, 1],
-                    translateY: [10, 0],
-                    delay: anime.stagger(50),
-                    duration: 400,
-                    easing: 'easeOutQuad'
-                });
+    const loadFiles = async (refresh = false) => {
+        const channelName = explorerChannelSelect.value;
+        if (!channelName) return;
+
+        listState = { files: [], nextCursor: null, total: 0, loading: false, channel: channelName, generation: listState.generation + 1 };
+        fileListContainer.scrollTop = 0;
+        fileListContainer.innerHTML = '<div class="flex items-center justify-center h-full"><i class="fa-solid fa-circle-notch fa-spin text-2xl text-violet-500"></i></div>';
 
+        try {
+            const generation = listState.generation;
+            const spacer = document.createElement('div');
+            spacer.className = 'virtual-spacer relative';
+            await fetchPage(refresh);
+            if (generation !== listState.generation) return;
+
+            if (listState.files.length > 0) {
+                fileListContainer.replaceChildren(spacer);
+                renderVisibleRows();
             } else {
                 fileListContainer.innerHTML = `
                     <div class="flex flex-col items-center justify-center h-full text-slate-500 gap-2">
@@ -119,6 +177,19 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     };
 
+    let scrollFrame = null;
+    fileListContainer.addEventListener('scroll', () => {
+        if (scrollFrame) return;
+        scrollFrame = requestAnimationFrame(() => { scrollFrame = null; renderVisibleRows(); });
+    });
+
+    let searchTimer = null;
+    searchInput.addEventListener('input', () => {
+        clearTimeout(searchTimer);
+        searchTimer = setTimeout(() => loadFiles(), 300);
+    });
+    [sortSelect, typeSelect, encryptionSelect].forEach(select => select.addEventListener('change', () => loadFiles()));
+
     const triggerDownload = (file, channelName) => {
         const form = document.createElement('form');
         form.method = 'POST';
@@ -191,11 +262,11 @@ document.addEventListener('DOMContentLoaded', () => {
         }, 4000);
     };
 
-    explorerChannelSelect.addEventListener('change', loadFiles);
+    explorerChannelSelect.addEventListener('change', () => loadFiles());
     refreshButton.addEventListener('click', () => {
         const icon = refreshButton.querySelector('i');
         icon.classList.add('fa-spin');
-        loadFiles().then(() => setTimeout(() => icon.classList.remove('fa-spin'), 500));
+        loadFiles(true).then(() => setTimeout(() => icon.classList.remove('fa-spin'), 500));
     });
 
     // Load initial files if channel selected
@@ -293,6 +364,12 @@ document.addEventListener('DOMContentLoaded', () => {
             formData.append('folder_name', folderNameInput.value);
         }
 
+        // Incremental sync against the folder's previous version
+        if (isFolderUpload) {
+            formData.append('sync', document.getElementById('sync-checkbox').checked);
+            formData.append('prune', document.getElementById('prune-checkbox').checked);
+        }
+
         stagedFiles.forEach(file => {
             const fileName = file.webkitRelativePath || file.name;
             formData.append('files[]', file, fileName);
@@ -0,0 +1,54 @@
+import asyncio
+from contextlib import asynccontextmanager
+from .util import logger
+
+
+class _Entry:
+    __slots__ = ('task', 'waiters', 'release', 'released')
+
+    def __init__(self, task, release):
+        self.task = task
+        self.waiters = 0
+        self.release = release
+        self.released = False
+
+
+class InFlight:
+    """
+    Shares one running fetch between every concurrent caller asking for the same key.
+    Callers hold the shared result inside `join()`; once the fetch has finished and the
+    last caller has left, the optional `release` callback disposes of the result.
+    """
+    def __init__(self):
+        self._entries = {}
+
+    @asynccontextmanager
+    async def join(self, key, factory, release=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = _Entry(asyncio.ensure_future(factory()), release)
+            self._entries[key] = entry
+            entry.task.add_done_callback(lambda _: self._finished(key, entry))
+        else:
+            logger.info(f"Joining in-flight request for {key}")
+
+        entry.waiters += 1
+        try:
+            # Shielded so one caller going away doesn't cancel the fetch for the others
+            yield await asyncio.shield(entry.task)
+        finally:
+            entry.waiters -= 1
+            self._maybe_release(entry)
+
+    def _finished(self, key, entry):
+        if self._entries.get(key) is entry: del self._entries[key]
+        self._maybe_release(entry)
+
+    def _maybe_release(self, entry):
+        if entry.released or entry.waiters or not entry.task.done(): return
+        entry.released = True
+        if entry.release is None or entry.task.cancelled() or entry.task.exception() is not None: return
+        try:
+            entry.release(entry.task.result())
+        except Exception as e:
+            logger.error(f"Error releasing shared result: {e}")
@@ -0,0 +1,84 @@
+import json, os, struct
+from cryptography.fernet import Fernet, MultiFernet
+from .util import ENCRYPTION_KEY
+
+# --- Envelope Encryption Setup ---
+# Each encrypted object gets its own random data key. The data key encrypts the object's
+# chunks and metadata, and is itself wrapped by a versioned master key stored alongside
+# the metadata. Rotating the master key only rewrites the small wrapped key.
+#   enc_key             -> active master key
+#   enc_key_version     -> version number of the active master key (default 1)
+#   enc_keys_retired    -> "version:key,version:key" older master keys kept for unwrapping
+ACTIVE_KEY_VERSION = int(os.getenv("enc_key_version", "1"))
+MASTER_KEYS = {ACTIVE_KEY_VERSION: Fernet(ENCRYPTION_KEY)}
+for entry in filter(None, (e.strip() for e in os.getenv("enc_keys_retired", "").split(','))):
+    version, _, key = entry.partition(':')
+    MASTER_KEYS.setdefault(int(version), Fernet(key.encode()))
+
+# Objects uploaded before envelope encryption were encrypted directly with whichever master
+# key was active at the time, so they are tried against the active key and every retired one
+LEGACY_CIPHER = MultiFernet(list(MASTER_KEYS.values()))
+
+ENVELOPE_MAGIC = b"DFSE1"
+
+
+class ObjectKey:
+    """A per-object data key together with its wrapped form."""
+    def __init__(self, data_key, header):
+        self.cipher = Fernet(data_key)
+        self.header = header
+        self._data_key = data_key
+
+    @classmethod
+    def generate(cls):
+        data_key = Fernet.generate_key()
+        return cls(data_key, _wrap(data_key))
+
+    @classmethod
+    def unwrap(cls, header):
+        master = MASTER_KEYS.get(header["kv"])
+        if master is None: raise KeyError(f"Master key version {header['kv']} is not configured.")
+        return cls(master.decrypt(header["dk"].encode()), header)
+
+    @property
+    def is_current(self):
+        return self.header["kv"] == ACTIVE_KEY_VERSION
+
+    def rewrapped(self):
+        """Returns the same data key wrapped with the active master key."""
+        return ObjectKey(self._data_key, _wrap(self._data_key))
+
+def _wrap(data_key):
+    return {"kv": ACTIVE_KEY_VERSION, "dk": MASTER_KEYS[ACTIVE_KEY_VERSION].encrypt(data_key).decode()}
+
+# --- Envelope Blobs ---
+# Layout: MAGIC | u32 header length | header JSON ({"kv", "dk"}) | Fernet(data key) payload
+def _join(header, body):
+    header_bytes = json.dumps(header, separators=(',', ':')).encode()
+    return ENVELOPE_MAGIC + struct.pack('>I', len(header_bytes)) + header_bytes + body
+
+def seal(payload, object_key):
+    return _join(object_key.header, object_key.cipher.encrypt(payload))
+
+def is_envelope(content):
+    return content.startswith(ENVELOPE_MAGIC)
+
+def _split(content):
+    offset = len(ENVELOPE_MAGIC)
+    (header_length,) = struct.unpack('>I', content[offset:offset + 4])
+    header = json.loads(content[offset + 4:offset + 4 + header_length])
+    return header, content[offset + 4 + header_length:]
+
+def open_envelope(content):
+    """Returns (payload bytes, ObjectKey) for an envelope blob."""
+    header, body = _split(content)
+    object_key = ObjectKey.unwrap(header)
+    return object_key.cipher.decrypt(body), object_key
+
+def envelope_key_version(content):
+    return _split(content)[0]["kv"]
+
+def rewrap_envelope(content):
+    """Re-wraps an envelope's data key with the active master key; the payload is left untouched."""
+    header, body = _split(content)
+    return _join(ObjectKey.unwrap(header).rewrapped().header, body)
@@ -1,15 +1,60 @@
 import discord
 import os
-import json
 import uuid
 import asyncio
 import shutil
+import time
+from collections import deque
 from ..dis_commands import bot
-from .util import logger, cipher, DATA_DIRECTORY, process_and_chunk_file
+from .util import logger, DATA_DIRECTORY, file_digest, process_and_chunk_file, write_handoff, read_handoff
+from .coalesce import InFlight
+from .manifest import (
+    MANIFEST_FORMAT,
+    encode_manifest,
+    decode_manifest,
+    read_metadata_blob,
+    open_metadata_blob,
+    shard_tree,
+    count_files,
+    iter_tree_files,
+    tree_from_files,
+    resolve_path,
+    expand_tree,
+)
+from .envelope import ObjectKey, ACTIVE_KEY_VERSION, LEGACY_CIPHER, seal, is_envelope, envelope_key_version, rewrap_envelope
+from .replication import ChunkSources, resolve_replica_channels
+from .journal import UploadJournal, UploadInterrupted, incomplete_journals
+from .listing import summarize, query_files
+from .scheduler import (
+    scheduler,
+    scheduled_history,
+    build_file_cache,
+    run_in_background,
+    PRIORITY_INTERACTIVE,
+    PRIORITY_BULK_READ,
+    PRIORITY_WRITE,
+    PRIORITY_BACKGROUND,
+    INTERACTIVE_CHUNK_LIMIT,
+)
+
+# Concurrent identical downloads and listings share a single fetch
+_in_flight = InFlight()
+
+# Channel listings are reused briefly so paging through them doesn't rescan history
+LISTING_CACHE_TTL = 30
+_listing_cache = {}
+
+# Folders uploaded from disk are staged and chunked at most this many bytes ahead of the sender
+STAGING_WINDOW = 256 * 1024 * 1024
 
 # --- Upload Operations ---
-async def upload_single_file(file_path, original_filename, server_id, channel_name, secure):
-    """Handles the upload process for a single file using the unified chunker."""
+# Uploads are journaled (see journal.py): chunks are sent first and the metadata last, so
+# an interrupted upload never appears in listings and can be resumed with resume_upload().
+async def upload_single_file(file_path, original_filename, server_id, channel_name, secure, progress=None):
+    """
+    Handles the upload process for a single file using the unified chunker.
+    progress(done, total, attachment name) is called after each confirmed send.
+    """
     guild = bot.get_guild(int(server_id))
     if not guild: return logger.error(f"Upload failed: Guild {server_id} not found.")
     channel = discord.utils.get(guild.text_channels, name=channel_name)
@@ -19,36 +64,53 @@ async def upload_single_file(file_path, original_filename, server_id, channel_na
         # Get original file size BEFORE processing (processing modifies/moves the file)
         original_size = os.path.getsize(file_path)
         
-        # Use the unified helper for all processing and naming
-        chunk_paths, chunk_basenames = process_and_chunk_file(file_path, secure)
+        # Encrypted objects get their own data key, wrapped by the master key in the metadata
+        object_key = ObjectKey.generate() if secure else None
+
+        # Use the unified helper for all processing and naming; encryption runs off the bot loop
+        chunk_paths, chunk_basenames = await asyncio.to_thread(process_and_chunk_file, file_path, secure, object_key.cipher if object_key else None)
+        replica_channels = resolve_replica_channels(guild, channel)
 
         metadata = {
             "original_filename": original_filename,
             "original_size": original_size,
             "chunks": chunk_basenames,
+            "chunk_sizes": [os.path.getsize(chunk_path) for chunk_path in chunk_paths],
             "encrypted": secure
         }
-        metadata_filename = os.path.join(DATA_DIRECTORY, f"{uuid.uuid4()}_metadata.json")
-        metadata_content = json.dumps(metadata).encode()
-        if secure: metadata_content = cipher.encrypt(metadata_content)
-        with open(metadata_filename, 'wb') as f: f.write(metadata_content)
+        if replica_channels: metadata["replica_channels"] = [c.id for c in replica_channels]
+        metadata_filename = _write_metadata_blob(metadata, object_key)
 
         # Upload metadata using the filename base (strip original extension)
         metadata_attachment_name = f"{os.path.splitext(original_filename)[0]}_metadata.json"
-        await channel.send(file=discord.File(metadata_filename, filename=metadata_attachment_name))
-        os.remove(metadata_filename)
-
-        for chunk_path in chunk_paths:
-            await channel.send(file=discord.File(chunk_path, filename=os.path.basename(chunk_path)))
-            os.remove(chunk_path) # Clean up chunk as we go
-            await asyncio.sleep(1.5)
-
-        logger.info(f"Successfully uploaded '{original_filename}'.")
+        journal = UploadJournal.create(
+            server_id, channel_name, original_filename,
+            targets=[channel.id, *(c.id for c in replica_channels)],
+            chunks=[(chunk_path, os.path.basename(chunk_path)) for chunk_path in chunk_paths],
+            manifests=[(metadata_filename, metadata_attachment_name)],
+        )
     except Exception as e:
         logger.error(f"An error occurred during upload for '{original_filename}': {e}")
+        raise
+
+    await _send_journal(journal, guild, progress)
+    journal.complete()
+    invalidate_listing(server_id, channel_name)
+    logger.info(f"Successfully uploaded '{original_filename}'.")
 
-async def upload_folder(metadata_obj, chunk_paths, server_id, channel_name):
-    """Uploads a single metadata file, then all the chunks for a folder."""
+async def upload_folder(upload_path, server_id, channel_name, object_key=None, supersedes=(), progress=None):
+    """
+    Uploads all the chunks for a folder, then its metadata.
+    upload_path is a handoff file (see write_handoff) holding {"metadata": the folder metadata
+    with its full tree, "chunks": names of the chunk files in DATA_DIRECTORY to send}.
+    object_key is the data key the chunks were encrypted with (required if encrypted).
+    supersedes lists the manifest message ids of the version being replaced, for resume.
+    progress(done, total, attachment name) is called after each confirmed send.
+    """
+    upload = await asyncio.to_thread(read_handoff, upload_path)
+    metadata_obj = upload["metadata"]
+    # Only names are handed over, so every chunk path stays inside the data directory
+    chunk_paths = [os.path.join(DATA_DIRECTORY, os.path.basename(name)) for name in upload["chunks"]]
     guild = bot.get_guild(int(server_id))
     if not guild:
         logger.error(f"Upload failed: Guild {server_id} not found.")
@@ -58,33 +120,287 @@ async def upload_folder(metadata_obj, chunk_paths, server_id, channel_name):
         logger.error(f'Upload failed: Channel "{channel_name}" not found.')
         return
 
-    # 1. Prepare and Upload Metadata
-    metadata_filename = os.path.join(DATA_DIRECTORY, f"{uuid.uuid4()}_metadata.json")
-    metadata_content = json.dumps(metadata_obj, indent=2).encode()
-    if metadata_obj.get("encrypted", False): metadata_content = cipher.encrypt(metadata_content)
-    with open(metadata_filename, 'wb') as f: f.write(metadata_content)
+    # Every chunk is also copied to the replica channels listed in the metadata.
+    # A synced version keeps its predecessor's replicas, which already hold the reused chunks.
+    if "replica_channels" in metadata_obj:
+        replica_channels = [c for c in (guild.get_channel(cid) for cid in metadata_obj["replica_channels"]) if c]
+    else:
+        replica_channels = resolve_replica_channels(guild, channel)
+        if replica_channels: metadata_obj["replica_channels"] = [c.id for c in replica_channels]
+
+    # 1. Prepare Metadata: a summary-only root plus the tree split into shards
+    if metadata_obj.get("encrypted", False) and object_key is None:
+        raise ValueError("Encrypted folder uploads require the object's data key.")
+    manifests = _write_folder_manifests(metadata_obj, object_key)
+    journal = UploadJournal.create(
+        server_id, channel_name, metadata_obj["folder_name"],
+        targets=[channel.id, *(c.id for c in replica_channels)],
+        chunks=[(chunk_path, os.path.basename(chunk_path).replace(' ', '_')) for chunk_path in chunk_paths],
+        manifests=manifests,
+        supersedes=supersedes,
+    )
+
+    # 2. Upload All Chunks, then the metadata
+    logger.info(f"Uploading {len(chunk_paths)} chunks and {len(manifests)} manifest(s) for folder '{metadata_obj['folder_name']}'...")
+    await _send_journal(journal, guild, progress)
+    journal.complete()
+    invalidate_listing(server_id, channel_name)
+    logger.info(f"Successfully uploaded folder '{metadata_obj['folder_name']}'.")
+
+async def upload_folder_files(sources, folder_name, server_id, channel_name, encrypt=False, parallel=4, progress=None):
+    """
+    Uploads a folder straight from local files. sources: [(relative path, local path)].
+    Files are staged, hashed and chunked on up to `parallel` threads, at most STAGING_WINDOW
+    bytes ahead of the sender, so the folder is never copied to disk as a whole.
+    progress(done, total, relative path) is called after each file is sent.
+    """
+    guild = bot.get_guild(int(server_id))
+    if not guild:
+        logger.error(f"Upload failed: Guild {server_id} not found.")
+        return
+    channel = discord.utils.get(guild.text_channels, name=channel_name)
+    if not channel:
+        logger.error(f'Upload failed: Channel "{channel_name}" not found.')
+        return
+
+    replica_channels = resolve_replica_channels(guild, channel)
+    object_key = ObjectKey.generate() if encrypt else None
+    metadata = {"upload_type": "folder", "folder_name": folder_name, "encrypted": encrypt}
+    if replica_channels: metadata["replica_channels"] = [c.id for c in replica_channels]
+    # Only the wrapped data key is journaled, so a resume can keep encrypting with it
+    journal = UploadJournal.create(
+        server_id, channel_name, folder_name,
+        targets=[channel.id, *(c.id for c in replica_channels)],
+        chunks=[], manifests=[],
+        folder={"metadata": metadata, "object_key": object_key.header if object_key else None, "parallel": parallel},
+        sources=[[relative_path, os.path.abspath(local_path)] for relative_path, local_path in sources],
+    )
+
+    logger.info(f"Uploading {len(sources)} files for folder '{folder_name}'...")
+    await _stream_folder(journal, guild, progress)
+    journal.complete()
+    invalidate_listing(server_id, channel_name)
+    logger.info(f"Successfully uploaded folder '{folder_name}'.")
+
+async def _stream_folder(journal, guild, progress=None):
+    """
+    Prepares the rest of a journaled folder while sending it, then sends its manifests.
+    Anything prepared but unsent when a previous attempt stopped is sent first.
+    """
+    folder = journal.state["folder"]
+    object_key = ObjectKey.unwrap(folder["object_key"]) if folder.get("object_key") else None
+    await _send_journal(journal, guild)
+    if folder.get("sealed"): return
+
+    sources = journal.remaining_sources()
+    done, total = folder["prepared"], folder["prepared"] + len(sources)
+    parallel = max(1, folder.get("parallel", 4))
+    ahead, staged, position = deque(), 0, 0
+    try:
+        while True:
+            # Keep up to `parallel` files preparing, within the staging window (but always the next one)
+            while position < len(sources) and len(ahead) < parallel and (not ahead or staged < STAGING_WINDOW):
+                relative_path, local_path = sources[position]
+                size = os.path.getsize(local_path)
+                task = asyncio.ensure_future(asyncio.to_thread(_prepare_source, local_path, object_key))
+                ahead.append((relative_path, size, task))
+                staged += size
+                position += 1
+            if not ahead: break
+
+            relative_path, size, task = ahead.popleft()
+            entry, chunk_paths = await task
+            journal.record_file(relative_path, entry, [(path, os.path.basename(path)) for path in chunk_paths])
+            for journal_entry in journal.state["entries"][-len(chunk_paths):]:
+                await _send_entry(journal, guild, journal_entry, journal_entry["targets"])
+            staged -= size
+            done += 1
+            if progress: progress(done, total, relative_path)
+    except BaseException as e:
+        # Files prepared ahead but never journaled are prepared again by a resume
+        for _, _, task in ahead: task.add_done_callback(_discard_prepared)
+        if not isinstance(e, Exception):
+            journal.release()
+            raise
+        raise _interrupted(journal, e) from e
 
+    metadata = dict(folder["metadata"], tree=tree_from_files(journal.prepared_files()))
+    metadata["total_size"] = sum(entry["size"] for _, entry in iter_tree_files(metadata["tree"])) # original size of all files
+    journal.add_manifests(_write_folder_manifests(metadata, object_key))
+    await _send_journal(journal, guild)
+
+def _prepare_source(local_path, object_key=None):
+    """Stages, hashes and chunks one local file. Returns (tree entry, chunk paths)."""
+    staged_path = os.path.join(DATA_DIRECTORY, f"{uuid.uuid4()}{os.path.splitext(local_path)[1]}")
     try:
-        logger.info(f"Uploading metadata for folder '{metadata_obj['folder_name']}'...")
-        await channel.send(file=discord.File(metadata_filename, filename=f"{metadata_obj['folder_name']}_metadata.json"))
+        shutil.copyfile(local_path, staged_path)
+        entry = {"type": "file", "size": os.path.getsize(staged_path), "sha256": file_digest(staged_path)}
+        chunk_paths, chunk_basenames = process_and_chunk_file(staged_path, object_key is not None, object_key.cipher if object_key else None)
     finally:
-        os.remove(metadata_filename)
+        if os.path.exists(staged_path): os.remove(staged_path)
+    entry["chunks"] = chunk_basenames
+    entry["chunk_sizes"] = [os.path.getsize(chunk_path) for chunk_path in chunk_paths]
+    return entry, chunk_paths
 
-    # 2. Upload All Chunks
-    logger.info(f"Uploading {len(chunk_paths)} total chunks...")
-    for i, chunk_path in enumerate(chunk_paths):
-        try:
-            logger.info(f"Uploading chunk {i+1}/{len(chunk_paths)}: {os.path.basename(chunk_path)}")
-            await channel.send(file=discord.File(chunk_path, filename=os.path.basename(chunk_path).replace(' ', '_')))
-            await asyncio.sleep(1.5)
-        finally:
-            if os.path.exists(chunk_path): os.remove(chunk_path)
-    logger.info(f"Successfully uploaded folder '{metadata_obj['folder_name']}'.")
+def _discard_prepared(task):
+    if task.cancelled() or task.exception() is not None: return
+    for chunk_path in task.result()[1]:
+        if os.path.exists(chunk_path): os.remove(chunk_path)
+
+def _write_folder_manifests(metadata_obj, object_key=None):
+    """
+    Writes a folder's shards and root metadata to temp files. Returns [(path, attachment name)].
+    Shards come before the root so the root never references a missing shard.
+    """
+    shards, shard_starts = shard_tree(metadata_obj["tree"])
+    manifest_id = uuid.uuid4().hex[:8]
+    shard_names = [f"{metadata_obj['folder_name']}_{manifest_id}_manifest_{i}.bin".replace(' ', '_') for i in range(len(shards))]
+    root_metadata = {key: value for key, value in metadata_obj.items() if key != "tree"}
+    root_metadata.update({
+        "format": MANIFEST_FORMAT,
+        "file_count": count_files(metadata_obj["tree"]),
+        "shards": shard_names,
+        "shard_starts": shard_starts,
+    })
+
+    # Only the root carries the wrapped key; shards are encrypted with the data key directly
+    manifests = [(_write_metadata_blob(shard, object_key, envelope=False), name) for shard, name in zip(shards, shard_names)]
+    manifests.append((_write_metadata_blob(root_metadata, object_key), f"{metadata_obj['folder_name']}_metadata.json"))
+    return manifests
+
+async def _send_journal(journal, guild, progress=None):
+    """
+    Sends every journal entry not yet confirmed by all of its target channels, in order.
+    Each confirmed send is recorded before the next one starts.
+    """
+    pending = list(journal.pending())
+    try:
+        for i, (entry, missing) in enumerate(pending):
+            logger.info(f"Uploading {i+1}/{len(pending)}: {entry['name']}")
+            await _send_entry(journal, guild, entry, missing)
+            if progress: progress(i + 1, len(pending), entry["name"])
+    except Exception as e:
+        raise _interrupted(journal, e) from e
+    except BaseException:
+        journal.release()
+        raise
+
+async def _send_entry(journal, guild, entry, channel_ids):
+    for channel_id in channel_ids:
+        target = guild.get_channel(channel_id)
+        if target is None: raise LookupError(f"Channel {channel_id} is no longer available.")
+        # The scheduler paces sends per channel, so no explicit sleep between chunks
+        async with scheduler.slot(PRIORITY_WRITE, target):
+            await target.send(file=discord.File(entry["path"], filename=entry["name"]))
+        journal.mark_sent(entry, channel_id)
+
+def _interrupted(journal, error):
+    """Releases an upload's journal and returns the UploadInterrupted to raise for it."""
+    journal.release()
+    if isinstance(error, UploadInterrupted): return error
+    logger.error(f"Upload of '{journal.state['object_name']}' interrupted; resume it with upload id {journal.upload_id}. ({error})")
+    return UploadInterrupted(journal.upload_id, error)
+
+async def resume_upload(upload_id, progress=None):
+    """
+    Finishes an interrupted upload, sending only what its journal hasn't confirmed.
+    Returns the journal summary, or None if there is no such incomplete upload
+    (including one that is still being sent).
+    """
+    journal = UploadJournal.load(upload_id)
+    if not journal: return None
+    if not journal.claim():
+        logger.warning(f"Upload {upload_id} is still being sent; not resuming it.")
+        return None
+    # Another sender may have progressed (or finished) between loading and claiming
+    if not journal.reload():
+        journal.release()
+        return None
+    journal.save() # Folds the change log back into the journal
+    try:
+        server_id, channel_name = journal.state["server_id"], journal.state["channel_name"]
+        guild = bot.get_guild(int(server_id))
+        if not guild: raise LookupError(f"Guild {server_id} not found.")
+
+        if "folder" in journal.state:
+            await _stream_folder(journal, guild, progress)
+        else:
+            await _send_journal(journal, guild, progress)
+        # A resumed sync still has to retire the version it replaced
+        channel = discord.utils.get(guild.text_channels, name=channel_name)
+        for message_id in journal.state.get("supersedes", []):
+            try:
+                async with scheduler.slot(PRIORITY_BACKGROUND, channel):
+                    await channel.get_partial_message(message_id).delete()
+            except discord.errors.NotFound:
+                pass
+        journal.complete()
+    finally:
+        journal.release()
+    invalidate_listing(server_id, channel_name)
+    return journal.summary()
+
+
+def _write_metadata_blob(metadata_obj, object_key=None, envelope=True):
+    """Encodes (and optionally encrypts) a metadata object into a temp file, returning its path."""
+    metadata_filename = os.path.join(DATA_DIRECTORY, f"{uuid.uuid4()}_metadata.json")
+    metadata_content = encode_manifest(metadata_obj)
+    if object_key:
+        metadata_content = seal(metadata_content, object_key) if envelope else object_key.cipher.encrypt(metadata_content)
+    with open(metadata_filename, 'wb') as f: f.write(metadata_content)
+    return metadata_filename
 
 
 # --- Download Operations ---
 async def download_from_discord(server_id, channel_name, requested_path):
-    """Downloads a file or folder, with synchronized and robust error handling."""
+    """
+    Downloads a file or folder into a private temp directory and returns its path.
+    Concurrent requests for the same object share one fetch; each caller gets its own copy.
+    """
+    key = ("download", str(server_id), channel_name, requested_path)
+    fetch = lambda: _fetch_to_work_dir(server_id, channel_name, requested_path)
+    async with _in_flight.join(key, fetch, release=_remove_work_dir) as shared_path:
+        if not shared_path: return None
+        return _private_copy(shared_path)
+
+def cleanup_download(file_path):
+    """Removes a file returned by download_from_discord together with its private directory."""
+    _remove_work_dir(file_path)
+
+def _new_work_dir(prefix):
+    work_dir = os.path.join(DATA_DIRECTORY, f"{prefix}_{uuid.uuid4().hex}")
+    os.makedirs(work_dir)
+    return work_dir
+
+def _remove_work_dir(file_path):
+    work_dir = os.path.dirname(file_path)
+    # Never remove the data directory itself, only the per-request directories inside it
+    if os.path.dirname(work_dir) == DATA_DIRECTORY:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    elif os.path.exists(file_path):
+        os.remove(file_path)
+
+def _private_copy(shared_path):
+    """Hard-links (or copies) the shared result into a directory owned by one request."""
+    private_path = os.path.join(_new_work_dir("download"), os.path.basename(shared_path))
+    try:
+        os.link(shared_path, private_path)
+    except OSError:
+        shutil.copyfile(shared_path, private_path)
+    return private_path
+
+async def _fetch_to_work_dir(server_id, channel_name, requested_path):
+    work_dir = _new_work_dir("fetch")
+    try:
+        result_path = await _download_from_discord(server_id, channel_name, requested_path, work_dir)
+    except BaseException:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        raise
+    if not result_path: shutil.rmtree(work_dir, ignore_errors=True)
+    return result_path
+
+async def _download_from_discord(server_id, channel_name, requested_path, work_dir):
+    """Downloads a file or folder into work_dir, with synchronized and robust error handling."""
     # Get guild and channel
     guild = bot.get_guild(int(server_id))
     if not guild: return logger.error(f"Download failed: Guild {server_id} not found.")
@@ -99,139 +415,237 @@ async def download_from_discord(server_id, channel_name, requested_path):
     
     # Build file cache
     logger.info("Building file cache from channel history...")
-    file_cache = {
-        attachment.filename: message
-        async for message in channel.history(limit=2000)
-        for attachment in message.attachments
-    }
+    file_cache = await build_file_cache(channel, PRIORITY_INTERACTIVE)
     logger.info(f"Cache built with {len(file_cache)} files.")
 
     # Get metadata
-    metadata_message = None
-    
-    # 1. Exact match attempt
-    if metadata_filename_to_find in file_cache:
-        metadata_message = file_cache[metadata_filename_to_find]
-        logger.info(f"Metadata found via exact match: {metadata_filename_to_find}")
-    
-    # 2. Fallback: Try sanitized version (Discord replaces spaces with underscores)
-    if not metadata_message:
-        sanitized_name = metadata_filename_to_find.replace(' ', '_')
-        if sanitized_name in file_cache:
-            metadata_message = file_cache[sanitized_name]
-            logger.info(f"Metadata found via sanitized match: {sanitized_name}")
-            
+    metadata_message = _find_metadata_message(file_cache, metadata_filename_to_find)
     if not metadata_message: return logger.error(f"Metadata for '{root_object_name}' not found (checked '{metadata_filename_to_find}' and '{metadata_filename_to_find.replace(' ', '_')}').")
 
-    encrypted_metadata_content = await metadata_message.attachments[0].read()
-    try:
-        metadata = json.loads(cipher.decrypt(encrypted_metadata_content))
-    except Exception:
-        metadata = json.loads(encrypted_metadata_content)
-    
+    async with scheduler.slot(PRIORITY_INTERACTIVE, channel, cost=0):
+        encrypted_metadata_content = await metadata_message.attachments[0].read()
+    metadata, object_key = open_metadata_blob(encrypted_metadata_content)
+    if object_key and not object_key.is_current:
+        # Lazy rotation: re-wrap this object's data key under the active master key
+        run_in_background(_rewrap_metadata_message(metadata_message, PRIORITY_BACKGROUND))
+
     is_encrypted = metadata.get("encrypted", False)
+    # Legacy objects were encrypted directly with a master key, possibly since retired
+    data_cipher = (object_key.cipher if object_key else LEGACY_CIPHER) if is_encrypted else None
+    load_shard = _shard_loader(metadata, file_cache, channel, PRIORITY_INTERACTIVE, data_cipher)
 
-    # Get folder
-    if metadata.get("upload_type") == "folder":
-        path_parts = requested_path.split('/')
-        if len(path_parts) > 1:
-            logger.info(f"Request is for a specific file inside a folder: {requested_path}")
-            current_item = {"children": metadata["tree"]}
-            for part in path_parts:
-                current_item = current_item.get("children", {}).get(part)
+    # Chunks are read from the primary channel, hedged against any replica channels
+    replica_channels = [c for c in (guild.get_channel(cid) for cid in metadata.get("replica_channels", [])) if c]
+    sources = ChunkSources(channel, file_cache, replica_channels)
+
+    try:
+        # Get folder
+        if metadata.get("upload_type") == "folder":
+            path_parts = requested_path.split('/')
+            if len(path_parts) > 1:
+                logger.info(f"Request is for a specific file inside a folder: {requested_path}")
+                # Only the shards along the requested path are fetched
+                current_item = await resolve_path(metadata, path_parts, load_shard)
                 if not current_item:
                     logger.error(f"Path '{requested_path}' not found in folder metadata.")
                     return None
             
-            if current_item.get("type") == "file":
-                reassembled_file_path = os.path.join(DATA_DIRECTORY, os.path.basename(requested_path))
-                all_chunks_found = True
-                with open(reassembled_file_path, 'wb') as f:
-                    for chunk_filename in current_item["chunks"]:
-                        if chunk_filename in file_cache:
-                            f.write(await file_cache[chunk_filename].attachments[0].read())
-                        else:
-                            all_chunks_found = False
-                            break
-                if not all_chunks_found: return None
-                if is_encrypted:
-                    with open(reassembled_file_path, 'rb') as f: data = f.read()
-                    with open(reassembled_file_path, 'wb') as f: f.write(cipher.decrypt(data))
-                return reassembled_file_path
+                if current_item.get("type") == "file":
+                    reassembled_file_path = os.path.join(work_dir, os.path.basename(requested_path))
+                    all_chunks_found = True
+                    priority = _read_priority(current_item["chunks"])
+                    with open(reassembled_file_path, 'wb') as f:
+                        for chunk_filename in current_item["chunks"]:
+                            chunk_content = await sources.read(chunk_filename, priority)
+                            if chunk_content is not None:
+                                f.write(chunk_content)
+                            else:
+                                all_chunks_found = False
+                                break
+                    if not all_chunks_found: return None
+                    if data_cipher:
+                        with open(reassembled_file_path, 'rb') as f: data = f.read()
+                        with open(reassembled_file_path, 'wb') as f: f.write(data_cipher.decrypt(data))
+                    return reassembled_file_path
+                else:
+                    return None
             else:
-                return None
-        else:
-            logger.info(f"Request is for the entire folder: {metadata['folder_name']}. Preparing ZIP.")
-            base_download_path = os.path.join(DATA_DIRECTORY, metadata['folder_name'])
-            if os.path.exists(base_download_path): shutil.rmtree(base_download_path)
-            os.makedirs(base_download_path)
+                logger.info(f"Request is for the entire folder: {metadata['folder_name']}. Preparing ZIP.")
+                base_download_path = os.path.join(work_dir, metadata['folder_name'])
+                os.makedirs(base_download_path)
 
-            await _build_folder_from_tree(channel, metadata["tree"], base_download_path, file_cache, is_encrypted)
+                tree = await expand_tree(metadata, load_shard)
+                await _build_folder_from_tree(channel, tree, base_download_path, sources, data_cipher)
             
-            zip_path = os.path.join(DATA_DIRECTORY, f"{metadata['folder_name']}.zip")
-            shutil.make_archive(base_name=zip_path.replace('.zip', ''), format='zip', root_dir=base_download_path)
-            shutil.rmtree(base_download_path)
-            logger.info(f"Folder successfully zipped to {zip_path}")
-            return zip_path
-    else:
-        logger.info(f"Request is for a single file: {metadata['original_filename']}")
-        reassembled_file_path = os.path.join(DATA_DIRECTORY, metadata["original_filename"])
-        all_chunks_found = True
-        with open(reassembled_file_path, 'wb') as f:
-            for chunk_filename in metadata["chunks"]:
-                if chunk_filename in file_cache:
-                    f.write(await file_cache[chunk_filename].attachments[0].read())
-                else:
-                    logger.error(f"FATAL: Chunk '{chunk_filename}' not found for file '{metadata['original_filename']}'")
-                    all_chunks_found = False
-                    break
+                zip_path = os.path.join(work_dir, f"{metadata['folder_name']}.zip")
+                shutil.make_archive(base_name=zip_path.replace('.zip', ''), format='zip', root_dir=base_download_path)
+                shutil.rmtree(base_download_path)
+                logger.info(f"Folder successfully zipped to {zip_path}")
+                return zip_path
+        else:
+            logger.info(f"Request is for a single file: {metadata['original_filename']}")
+            reassembled_file_path = os.path.join(work_dir, metadata["original_filename"])
+            all_chunks_found = True
+            priority = _read_priority(metadata["chunks"])
+            with open(reassembled_file_path, 'wb') as f:
+                for chunk_filename in metadata["chunks"]:
+                    chunk_content = await sources.read(chunk_filename, priority)
+                    if chunk_content is not None:
+                        f.write(chunk_content)
+                    else:
+                        logger.error(f"FATAL: Chunk '{chunk_filename}' not found for file '{metadata['original_filename']}'")
+                        all_chunks_found = False
+                        break
         
-        if not all_chunks_found:
-            if os.path.exists(reassembled_file_path): os.remove(reassembled_file_path)
-            return None
-
-        if is_encrypted:
-            try:
-                with open(reassembled_file_path, 'rb') as f: data = f.read()
-                with open(reassembled_file_path, 'wb') as f: f.write(cipher.decrypt(data))
-            except Exception as e:
-                logger.error(f"Decryption failed for '{metadata['original_filename']}': {e}")
+            if not all_chunks_found:
                 if os.path.exists(reassembled_file_path): os.remove(reassembled_file_path)
                 return None
-        return reassembled_file_path
 
-async def _build_folder_from_tree(channel, metadata_tree, base_download_path, file_cache, is_encrypted):
+            if data_cipher:
+                try:
+                    with open(reassembled_file_path, 'rb') as f: data = f.read()
+                    with open(reassembled_file_path, 'wb') as f: f.write(data_cipher.decrypt(data))
+                except Exception as e:
+                    logger.error(f"Decryption failed for '{metadata['original_filename']}': {e}")
+                    if os.path.exists(reassembled_file_path): os.remove(reassembled_file_path)
+                    return None
+            return reassembled_file_path
+    finally:
+        sources.close()
+
+def _find_metadata_message(file_cache, metadata_filename):
+    """Finds a metadata attachment by exact name, then by Discord's sanitized name."""
+    # 1. Exact match attempt
+    if metadata_filename in file_cache:
+        logger.info(f"Metadata found via exact match: {metadata_filename}")
+        return file_cache[metadata_filename]
+
+    # 2. Fallback: Try sanitized version (Discord replaces spaces with underscores)
+    sanitized_name = metadata_filename.replace(' ', '_')
+    if sanitized_name in file_cache:
+        logger.info(f"Metadata found via sanitized match: {sanitized_name}")
+        return file_cache[sanitized_name]
+    return None
+
+def _shard_loader(metadata, file_cache, channel, priority, data_cipher=None):
+    """Returns a memoizing coroutine function that fetches manifest shards by index."""
+    loaded = {}
+    async def load_shard(index):
+        if index not in loaded:
+            shard_name = metadata["shards"][index]
+            message = file_cache.get(shard_name)
+            if not message: raise LookupError(f"Manifest shard '{shard_name}' not found in channel.")
+            async with scheduler.slot(priority, channel, cost=0):
+                content = await message.attachments[0].read()
+            loaded[index] = read_metadata_blob(content, data_cipher)
+        return loaded[index]
+    return load_shard
+
+def _read_priority(chunks):
+    """Small downloads are interactive; anything larger competes as a bulk read."""
+    return PRIORITY_INTERACTIVE if len(chunks) <= INTERACTIVE_CHUNK_LIMIT else PRIORITY_BULK_READ
+
+async def _build_folder_from_tree(channel, metadata_tree, base_download_path, sources, data_cipher):
     """Recursively traverses the metadata tree and downloads files."""
     for name, item in metadata_tree.items():
         current_path = os.path.join(base_download_path, name)
         if item["type"] == "directory":
             os.makedirs(current_path, exist_ok=True)
-            await _build_folder_from_tree(channel, item["children"], current_path, file_cache, is_encrypted)
+            await _build_folder_from_tree(channel, item["children"], current_path, sources, data_cipher)
         elif item["type"] == "file":
             logger.info(f"Reassembling file: {current_path}")
-            
-            all_chunks_found = True
-            with open(current_path, 'wb') as reassembled_file:
-                for chunk_filename in item["chunks"]:
-                    if chunk_filename in file_cache:
-                        chunk_message = file_cache[chunk_filename]
-                        chunk_content = await chunk_message.attachments[0].read()
-                        reassembled_file.write(chunk_content)
-                    else:
-                        logger.error(f"FATAL: Chunk '{chunk_filename}' for file '{name}' not found in cache!")
-                        all_chunks_found = False
-                        break
-            
-            if all_chunks_found and is_encrypted:
-                try:
-                    with open(current_path, 'rb') as f: encrypted_data = f.read()
-                    decrypted_data = cipher.decrypt(encrypted_data)
-                    with open(current_path, 'wb') as f: f.write(decrypted_data)
-                except Exception as e:
-                    logger.error(f"Decryption failed for '{name}': {e}")
-            elif not all_chunks_found:
-                 if os.path.exists(current_path):
-                     os.remove(current_path)
+            await _reassemble_file(item["chunks"], current_path, sources, data_cipher, PRIORITY_BULK_READ)
+
+async def _reassemble_file(chunks, destination, sources, data_cipher, priority):
+    """Downloads a file's chunks in order into destination and decrypts it. Returns False on failure."""
+    all_chunks_found = True
+    with open(destination, 'wb') as reassembled_file:
+        for chunk_filename in chunks:
+            chunk_content = await sources.read(chunk_filename, priority)
+            if chunk_content is not None:
+                reassembled_file.write(chunk_content)
+            else:
+                logger.error(f"FATAL: Chunk '{chunk_filename}' for file '{os.path.basename(destination)}' not found in any replica!")
+                all_chunks_found = False
+                break
+
+    if not all_chunks_found:
+        if os.path.exists(destination): os.remove(destination)
+        return False
+    if data_cipher:
+        try:
+            with open(destination, 'rb') as f: encrypted_data = f.read()
+            decrypted_data = data_cipher.decrypt(encrypted_data)
+            with open(destination, 'wb') as f: f.write(decrypted_data)
+        except Exception as e:
+            logger.error(f"Decryption failed for '{os.path.basename(destination)}': {e}")
+            return False
+    return True
+
+async def download_tree(server_id, channel_name, object_name, destination, parallel=4, progress=None):
+    """
+    Downloads a whole file or folder into the destination directory, fetching up to
+    `parallel` files at once. Files already present with their recorded size (and sha256)
+    are skipped, so an interrupted download resumes where it stopped.
+    progress(done, total, path) is called after each file.
+    Returns {"downloaded", "skipped", "failed"}, or None if the object was not found.
+    """
+    guild = bot.get_guild(int(server_id))
+    if not guild: return None
+    channel = discord.utils.get(guild.text_channels, name=channel_name)
+    if not channel: return None
+
+    object_name = object_name.rstrip('/')
+    file_cache = await build_file_cache(channel, PRIORITY_BULK_READ)
+    metadata_message = (_find_metadata_message(file_cache, f"{object_name}_metadata.json")
+                        or _find_metadata_message(file_cache, f"{os.path.splitext(object_name)[0]}_metadata.json"))
+    if not metadata_message: return None
+
+    async with scheduler.slot(PRIORITY_BULK_READ, channel, cost=0):
+        content = await metadata_message.attachments[0].read()
+    metadata, object_key = open_metadata_blob(content)
+    data_cipher = (object_key.cipher if object_key else LEGACY_CIPHER) if metadata.get("encrypted") else None
+    replica_channels = [c for c in (guild.get_channel(cid) for cid in metadata.get("replica_channels", [])) if c]
+    sources = ChunkSources(channel, file_cache, replica_channels)
+
+    if metadata.get("upload_type") == "folder":
+        load_shard = _shard_loader(metadata, file_cache, channel, PRIORITY_BULK_READ, data_cipher)
+        files = list(iter_tree_files(await expand_tree(metadata, load_shard)))
+        base = os.path.abspath(os.path.join(destination, metadata["folder_name"]))
+    else:
+        files = [(metadata["original_filename"], {"chunks": metadata["chunks"], "size": metadata.get("original_size")})]
+        base = os.path.abspath(destination)
+
+    summary = {"downloaded": 0, "skipped": 0, "failed": 0}
+    semaphore = asyncio.Semaphore(max(1, parallel))
+
+    async def fetch(path, entry):
+        target = os.path.join(base, *path.split('/'))
+        if os.path.commonpath([base, os.path.abspath(target)]) != base:
+            logger.error(f"Refusing to write '{path}' outside the destination.")
+            summary["failed"] += 1
+        elif await asyncio.to_thread(_is_downloaded, target, entry):
+            summary["skipped"] += 1
+        else:
+            async with semaphore:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                # Written under a temporary name so a partial file is never mistaken for a finished one
+                ok = await _reassemble_file(entry["chunks"], f"{target}.part", sources, data_cipher, PRIORITY_BULK_READ)
+                if ok: os.replace(f"{target}.part", target)
+                elif os.path.exists(f"{target}.part"): os.remove(f"{target}.part")
+            summary["downloaded" if ok else "failed"] += 1
+        if progress: progress(sum(summary.values()), len(files), path)
+
+    try:
+        await asyncio.gather(*(fetch(path, entry) for path, entry in files))
+    finally:
+        sources.close()
+    logger.info(f"Downloaded '{object_name}' to {base}: {summary}")
+    return summary
+
+def _is_downloaded(path, entry):
+    if not os.path.exists(path) or os.path.getsize(path) != entry.get("size"): return False
+    return "sha256" not in entry or file_digest(path) == entry["sha256"]
 
 
 # --- Delete Operations ---
@@ -256,24 +670,23 @@ async def delete_from_discord(server_id, channel_name, file_name):
         filenames_to_delete = set()
         metadata_message = None
         metadata_filename_found = None
+        matched_metadata = None
+        matched_key = None
         
         # Scan all messages for metadata files
         # We need to read content to confirm it's the right file, as filenames might start with UUIDs 
         # or be renamed by Discord (spaces -> underscores)
-        async for message in channel.history(limit=2000):
+        async for message in scheduled_history(channel, PRIORITY_BACKGROUND):
             for attachment in message.attachments:
                 if attachment.filename.endswith('_metadata.json'):
                     try:
-                        content = await attachment.read()
+                        async with scheduler.slot(PRIORITY_BACKGROUND, channel, cost=0):
+                            content = await attachment.read()
                         try:
-                            metadata = json.loads(content)
-                        except:
-                            # Try decrypting if not valid JSON directly
-                            try:
-                                metadata = json.loads(cipher.decrypt(content))
-                            except Exception:
-                                # Not a valid encrypted file or wrong key, skip
-                                continue
+                            metadata, object_key = open_metadata_blob(content)
+                        except Exception:
+                            # Not a valid metadata file or wrong key, skip
+                            continue
                         
                         # Check if this metadata matches our target
                         matched = False
@@ -293,25 +706,8 @@ async def delete_from_discord(server_id, channel_name, file_name):
                         if matched:
                             metadata_message = message
                             metadata_filename_found = attachment.filename
-                            
-                            # Extract chunks to delete
-                            if metadata.get("upload_type") == "folder":
-                                # Recursively extract chunks from tree
-                                def extract_chunks_from_tree(tree):
-                                    chunks = []
-                                    for name, item in tree.items():
-                                        if item.get("type") == "file":
-                                            chunks.extend(item.get("chunks", []))
-                                        elif item.get("type") == "directory":
-                                            chunks.extend(extract_chunks_from_tree(item.get("children", {})))
-                                    return chunks
-                                
-                                chunks = extract_chunks_from_tree(metadata.get("tree", {}))
-                                filenames_to_delete.update(chunks)
-                            else:
-                                # Single file
-                                filenames_to_delete.update(metadata.get("chunks", []))
-                            
+                            matched_metadata = metadata
+                            matched_key = object_key
                             break # Found our target, break inner loop
                             
                     except Exception as e:
@@ -325,13 +721,33 @@ async def delete_from_discord(server_id, channel_name, file_name):
             logger.warning(f"No metadata found for '{target_name}' after scanning channel.")
             return False
             
-        # Collect all messages to delete (metadata + chunks)
+        # Collect all messages to delete (metadata + manifest shards + chunks)
         messages_to_delete = [metadata_message]
-        
-        async for message in channel.history(limit=2000):
-            for attachment in message.attachments:
-                if attachment.filename in filenames_to_delete:
-                    messages_to_delete.append(message)
+        primary_messages = [message async for message in scheduled_history(channel, PRIORITY_BACKGROUND)]
+
+        if matched_metadata.get("upload_type") == "folder":
+            # Sharded manifests must be fully loaded to find every chunk
+            file_cache = await build_file_cache(channel, PRIORITY_BACKGROUND, primary_messages)
+            data_cipher = matched_key.cipher if matched_key else LEGACY_CIPHER
+            load_shard = _shard_loader(matched_metadata, file_cache, channel, PRIORITY_BACKGROUND, data_cipher)
+            tree = await expand_tree(matched_metadata, load_shard)
+            filenames_to_delete.update(_extract_chunks_from_tree(tree))
+            filenames_to_delete.update(matched_metadata.get("shards", []))
+        else:
+            # Single file
+            filenames_to_delete.update(matched_metadata.get("chunks", []))
+
+        # Chunks live in the primary channel and in every replica channel
+        replica_channels = [c for c in (guild.get_channel(cid) for cid in matched_metadata.get("replica_channels", [])) if c]
+        for chunk_channel in [channel, *replica_channels]:
+            if chunk_channel is channel:
+                history = primary_messages
+            else:
+                history = [message async for message in scheduled_history(chunk_channel, PRIORITY_BACKGROUND)]
+            for message in history:
+                for attachment in message.attachments:
+                    if attachment.filename in filenames_to_delete:
+                        messages_to_delete.append(message)
         
         logger.info(f"Found {len(messages_to_delete)} messages to delete for '{target_name}'")
         
@@ -339,14 +755,16 @@ async def delete_from_discord(server_id, channel_name, file_name):
         delete_count = 0
         for message in messages_to_delete:
             try:
-                await message.delete()
+                # Rate limiting is handled by the scheduler's API budget
+                async with scheduler.slot(PRIORITY_BACKGROUND, message.channel):
+                    await message.delete()
                 delete_count += 1
-                await asyncio.sleep(0.5)  # Rate limiting
             except discord.errors.NotFound:
                 pass
             except Exception as e:
                 logger.error(f"Error deleting message {message.id}: {e}")
         
+        invalidate_listing(server_id, channel_name)
         logger.info(f"Successfully deleted '{target_name}'")
         return True
 
@@ -354,8 +772,270 @@ async def delete_from_discord(server_id, channel_name, file_name):
         logger.error(f"An error occurred during delete for '{file_name}': {e}")
         return False
 
+def _extract_chunks_from_tree(tree):
+    """Recursively collects chunk names from a materialized folder tree."""
+    chunks = []
+    for name, item in tree.items():
+        if item.get("type") == "file":
+            chunks.extend(item.get("chunks", []))
+        elif item.get("type") == "directory":
+            chunks.extend(_extract_chunks_from_tree(item.get("children", {})))
+    return chunks
+
+# --- Sync Operations ---
+async def load_folder_manifest(server_id, channel_name, folder_name):
+    """
+    Loads the current version of a folder for incremental sync. Returns None if the folder
+    doesn't exist, otherwise its root metadata (without tree), a handoff file holding the
+    fully expanded tree (see read_handoff), the object's data key and the ids of the
+    manifest messages.
+    """
+    guild = bot.get_guild(int(server_id))
+    if not guild: return None
+    channel = discord.utils.get(guild.text_channels, name=channel_name)
+    if not channel: return None
+
+    file_cache = await build_file_cache(channel, PRIORITY_BULK_READ)
+    metadata_message = _find_metadata_message(file_cache, f"{folder_name}_metadata.json")
+    if not metadata_message: return None
+
+    async with scheduler.slot(PRIORITY_BULK_READ, channel, cost=0):
+        content = await metadata_message.attachments[0].read()
+    metadata, object_key = open_metadata_blob(content)
+    if metadata.get("upload_type") != "folder": return None
+
+    data_cipher = (object_key.cipher if object_key else LEGACY_CIPHER) if metadata.get("encrypted") else None
+    load_shard = _shard_loader(metadata, file_cache, channel, PRIORITY_BULK_READ, data_cipher)
+    tree = await expand_tree(metadata, load_shard)
+    shard_message_ids = [file_cache[name].id for name in metadata.get("shards", []) if name in file_cache]
+    return {
+        "metadata": {key: value for key, value in metadata.items() if key != "tree"},
+        "tree_path": await asyncio.to_thread(write_handoff, tree),
+        "object_key": object_key,
+        "message_ids": [metadata_message.id, *shard_message_ids],
+    }
+
+async def retire_folder_version(server_id, channel_name, previous, stale_chunks_path=None):
+    """
+    Removes a superseded folder manifest after a sync. stale_chunks_path, to prune, is a
+    handoff file listing the chunks the new version no longer references; they are deleted
+    too. Returns the number of pruned chunk messages.
+    """
+    stale_chunks = set(await asyncio.to_thread(read_handoff, stale_chunks_path)) if stale_chunks_path else set()
+    guild = bot.get_guild(int(server_id))
+    if not guild:
+        logger.error(f"Retire failed: Guild {server_id} not found.")
+        return 0
+    channel = discord.utils.get(guild.text_channels, name=channel_name)
+    if not channel:
+        logger.error(f"Retire failed: Channel '{channel_name}' not found.")
+        return 0
+
+    for message_id in previous["message_ids"]:
+        try:
+            async with scheduler.slot(PRIORITY_BACKGROUND, channel):
+                await channel.get_partial_message(message_id).delete()
+        except discord.errors.NotFound:
+            pass
+
+    invalidate_listing(server_id, channel_name)
+    if not stale_chunks: return 0
+
+    pruned = 0
+    replica_channels = [c for c in (guild.get_channel(cid) for cid in previous["metadata"].get("replica_channels", [])) if c]
+    for chunk_channel in [channel, *replica_channels]:
+        async for message in scheduled_history(chunk_channel, PRIORITY_BACKGROUND):
+            if not any(attachment.filename in stale_chunks for attachment in message.attachments): continue
+            try:
+                async with scheduler.slot(PRIORITY_BACKGROUND, chunk_channel):
+                    await message.delete()
+                pruned += 1
+            except discord.errors.NotFound:
+                pass
+    logger.info(f"Pruned {pruned} unreferenced chunk messages from the previous version.")
+    return pruned
+
+
+# --- Verify & Repair ---
+def _expected_chunks(metadata, tree=None):
+    """Returns [(chunk name, expected size)] for an object; size is None for uploads that predate chunk_sizes."""
+    if metadata.get("upload_type") == "folder":
+        entries = [entry for _, entry in iter_tree_files(tree)]
+    else:
+        entries = [metadata]
+    expected = []
+    for entry in entries:
+        sizes = entry.get("chunk_sizes") or [None] * len(entry["chunks"])
+        expected.extend(zip(entry["chunks"], sizes))
+    return expected
+
+async def verify_object(server_id, channel_name, object_name, repair=False):
+    """
+    Checks that every chunk of a file or folder exists, at the recorded size, in the primary
+    channel and each replica channel. With repair, re-sends only the bad copies, using a
+    chunk file still held by an upload journal or an intact copy from another channel.
+    Returns a report dict, or None if the object was not found.
+    """
+    guild = bot.get_guild(int(server_id))
+    if not guild: return None
+    channel = discord.utils.get(guild.text_channels, name=channel_name)
+    if not channel: return None
+
+    object_name = object_name.rstrip('/')
+    file_cache = await build_file_cache(channel, PRIORITY_BACKGROUND)
+    metadata_message = (_find_metadata_message(file_cache, f"{object_name}_metadata.json")
+                        or _find_metadata_message(file_cache, f"{os.path.splitext(object_name)[0]}_metadata.json"))
+    if not metadata_message: return None
+
+    async with scheduler.slot(PRIORITY_BACKGROUND, channel, cost=0):
+        content = await metadata_message.attachments[0].read()
+    metadata, object_key = open_metadata_blob(content)
+    tree = None
+    if metadata.get("upload_type") == "folder":
+        data_cipher = (object_key.cipher if object_key else LEGACY_CIPHER) if metadata.get("encrypted") else None
+        load_shard = _shard_loader(metadata, file_cache, channel, PRIORITY_BACKGROUND, data_cipher)
+        tree = await expand_tree(metadata, load_shard)
+
+    channels = [channel, *(c for c in (guild.get_channel(cid) for cid in metadata.get("replica_channels", [])) if c)]
+    caches = {channel.id: file_cache}
+    for replica in channels[1:]:
+        caches[replica.id] = await build_file_cache(replica, PRIORITY_BACKGROUND)
+
+    expected = _expected_chunks(metadata, tree)
+    report = {"object": object_name, "chunks": len(expected), "channels": [c.name for c in channels],
+              "missing": [], "wrong_size": [], "repaired": [], "unrecoverable": []}
+    journals = incomplete_journals() if repair else []
+
+    for chunk_name, expected_size in expected:
+        good, bad = [], []
+        for chunk_channel in channels:
+            message = caches[chunk_channel.id].get(chunk_name)
+            if message and (expected_size is None or message.attachments[0].size == expected_size):
+                good.append(message)
+            else:
+                bad.append((chunk_channel, message))
+                problem = "wrong_size" if message else "missing"
+                report[problem].append({"chunk": chunk_name, "channel": chunk_channel.name})
+        if not bad or not repair: continue
+
+        if await _repair_chunk(chunk_name, expected_size, good, bad, journals):
+            report["repaired"].extend({"chunk": chunk_name, "channel": c.name} for c, _ in bad)
+        else:
+            report["unrecoverable"].append({"chunk": chunk_name})
+
+    logger.info(f"Verified '{object_name}': {len(report['missing'])} missing, {len(report['wrong_size'])} wrong size, "
+                f"{len(report['repaired'])} repaired, {len(report['unrecoverable'])} unrecoverable.")
+    return report
+
+async def _repair_chunk(chunk_name, expected_size, good_messages, bad, journals):
+    """Re-sends one chunk to the channels in bad. Returns False if no intact source exists."""
+    temp_path = os.path.join(DATA_DIRECTORY, f"{uuid.uuid4()}_repair")
+    try:
+        # 1. A chunk file an interrupted upload still holds locally
+        source_path = next((path for path in (j.local_copy(chunk_name) for j in journals)
+                            if path and (expected_size is None or os.path.getsize(path) == expected_size)), None)
+        # 2. An intact copy in another channel
+        if source_path is None:
+            if not good_messages: return False
+            message = good_messages[0]
+            async with scheduler.slot(PRIORITY_BACKGROUND, message.channel, cost=0):
+                data = await message.attachments[0].read()
+            with open(temp_path, 'wb') as f: f.write(data)
+            source_path = temp_path
+
+        for chunk_channel, broken_message in bad:
+            if broken_message is not None:
+                async with scheduler.slot(PRIORITY_BACKGROUND, chunk_channel):
+                    await broken_message.delete()
+            async with scheduler.slot(PRIORITY_BACKGROUND, chunk_channel):
+                await chunk_channel.send(file=discord.File(source_path, filename=chunk_name))
+            logger.info(f"Repaired '{chunk_name}' in '{chunk_channel.name}'.")
+        return True
+    except Exception as e:
+        logger.error(f"Repair of '{chunk_name}' failed: {e}")
+        return False
+    finally:
+        if os.path.exists(temp_path): os.remove(temp_path)
+
+
+# --- Key Rotation ---
+async def _rewrap_metadata_message(message, priority):
+    """
+    Re-wraps the data key in a metadata message under the active master key.
+    Only the small metadata attachment is rewritten; chunk data is untouched.
+    Returns "rewrapped", "current", "legacy" or "plain".
+    """
+    attachment = message.attachments[0]
+    async with scheduler.slot(priority, message.channel, cost=0):
+        content = await attachment.read()
+    if not is_envelope(content):
+        # Unreadable without the master cipher means a legacy, directly-encrypted object
+        try:
+            decode_manifest(content)
+        except Exception:
+            return "legacy"
+        return "plain"
+    if envelope_key_version(content) == ACTIVE_KEY_VERSION: return "current"
+
+    temp_path = os.path.join(DATA_DIRECTORY, f"{uuid.uuid4()}_metadata.json")
+    try:
+        with open(temp_path, 'wb') as f: f.write(rewrap_envelope(content))
+        async with scheduler.slot(priority, message.channel):
+            await message.edit(attachments=[discord.File(temp_path, filename=attachment.filename)])
+        logger.info(f"Re-wrapped data key for '{attachment.filename}' with master key v{ACTIVE_KEY_VERSION}.")
+    finally:
+        if os.path.exists(temp_path): os.remove(temp_path)
+    return "rewrapped"
+
+async def rotate_channel_keys(server_id, channel_name):
+    """Bulk rotation: re-wraps every metadata data key in a channel under the active master key."""
+    guild = bot.get_guild(int(server_id))
+    if not guild: return None
+    channel = discord.utils.get(guild.text_channels, name=channel_name)
+    if not channel: return None
+
+    summary = {"rewrapped": 0, "current": 0, "legacy": 0, "plain": 0, "failed": 0}
+    async for message in scheduled_history(channel, PRIORITY_BACKGROUND):
+        for attachment in message.attachments:
+            if not attachment.filename.endswith('_metadata.json'): continue
+            try:
+                summary[await _rewrap_metadata_message(message, PRIORITY_BACKGROUND)] += 1
+            except Exception as e:
+                logger.error(f"Key rotation failed for {attachment.filename}: {e}")
+                summary["failed"] += 1
+    logger.info(f"Key rotation for channel '{channel_name}' finished: {summary}")
+    return summary
+
 # --- Listing Operations ---
-async def fetch_files_from_channel(server_id, channel_name):
+async def fetch_files_from_channel(server_id, channel_name, refresh=False):
+    """
+    Lists available files. Concurrent listings of the same channel share one scan,
+    and the result is cached for LISTING_CACHE_TTL seconds for paging (unless refresh).
+    """
+    if refresh: invalidate_listing(server_id, channel_name)
+    key = ("list", str(server_id), channel_name)
+    cached = _listing_cache.get(key)
+    if cached and time.monotonic() - cached[0] < LISTING_CACHE_TTL:
+        files = cached[1]
+    else:
+        async with _in_flight.join(key, lambda: _fetch_files_from_channel(server_id, channel_name)) as files:
+            _listing_cache[key] = (time.monotonic(), files)
+    return [dict(metadata) for metadata in files]
+
+async def list_files_page(server_id, channel_name, refresh=False, **query):
+    """
+    Returns one page of a channel listing; query takes the query_files() arguments.
+    Only the page leaves this process, so callers never hold (or transfer) the whole listing.
+    """
+    files = await fetch_files_from_channel(server_id, channel_name, refresh)
+    # Sorting a large channel is CPU work, kept off the bot loop
+    return await asyncio.to_thread(query_files, files, **query)
+
+def invalidate_listing(server_id, channel_name):
+    """Drops the cached listing for a channel after its contents change."""
+    _listing_cache.pop(("list", str(server_id), channel_name), None)
+
+async def _fetch_files_from_channel(server_id, channel_name):
     """Fetches and parses all metadata files from the channel to list available files."""
     guild = bot.get_guild(int(server_id))
     if not guild: return []
@@ -366,24 +1046,19 @@ async def fetch_files_from_channel(server_id, channel_name):
     
     # We need to read messages to find metadata files
     # This might be slow for huge history, but we'll use the same limit as download
-    async for message in channel.history(limit=2000):
+    async for message in scheduled_history(channel, PRIORITY_INTERACTIVE):
         for attachment in message.attachments:
             if attachment.filename.endswith('_metadata.json'):
                 try:
-                    content = await attachment.read()
+                    async with scheduler.slot(PRIORITY_INTERACTIVE, channel, cost=0):
+                        content = await attachment.read()
                     try:
-                        # Try decrypting first if it might be encrypted
-                        # But we don't know if it is encrypted until we read it or try
-                        # The upload logic decides encryption.
-                        # Metadata itself is encrypted if secure=True.
-                        # Let's try to load as JSON first, if fail, try decrypt
-                        metadata = json.loads(content)
-                    except:
-                        try:
-                            metadata = json.loads(cipher.decrypt(content))
-                        except Exception as e:
-                            logger.error(f"Failed to parse metadata {attachment.filename}: {e}")
-                            continue
+                        # Plain manifests decode directly, encrypted ones are decrypted first.
+                        # Only the summary is kept; older roots may still carry a whole tree.
+                        metadata = summarize(read_metadata_blob(content))
+                    except Exception as e:
+                        logger.error(f"Failed to parse metadata {attachment.filename}: {e}")
+                        continue
 
                     # Add timestamp from message
                     metadata['upload_date'] = message.created_at.strftime("%Y-%m-%d %H:%M:%S")
@@ -0,0 +1,246 @@
+import json, os, time, uuid
+from .util import logger, DATA_DIRECTORY
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+    import msvcrt
+
+# --- Upload Journal ---
+# Every upload is journaled before anything is sent. Each entry records the local file to
+# send, its attachment name and the channels that have confirmed receiving it. Chunk files
+# stay on disk until every target channel has them, so an interrupted upload can resume
+# by sending only what is missing. While an upload is being sent its sender holds an
+# exclusive lock on <upload_id>.lock, so it is neither listed as incomplete nor resumed a
+# second time (by this process, the daemon or the CLI). The OS drops the lock when the
+# sender exits, however it exits.
+# The journal JSON is only written whole when an upload starts or resumes; every change
+# after that (confirmed sends, added entries) is appended to <upload_id>.log and replayed
+# on load, so each send costs one small append however large the upload is.
+# Folders uploaded straight from disk are journaled as they are prepared: the local files
+# still to prepare live in <upload_id>.sources and the prepared tree entries in
+# <upload_id>.files, so resuming can carry on where preparation stopped.
+JOURNAL_DIRECTORY = os.path.join(DATA_DIRECTORY, 'journal')
+
+
+class UploadInterrupted(Exception):
+    """Raised when an upload stops partway; it can be finished later with its upload_id."""
+    def __init__(self, upload_id, cause):
+        super().__init__(f"Upload {upload_id} interrupted: {cause}")
+        self.upload_id = upload_id
+        self.cause = cause
+
+
+class UploadJournal:
+    def __init__(self, state, path):
+        self.state = state
+        self.path = path
+        self._lock_file = None
+        self._by_name = {}
+
+    @classmethod
+    def create(cls, server_id, channel_name, object_name, targets, chunks, manifests, supersedes=(), folder=None, sources=None):
+        """
+        targets: channel ids every entry must reach (primary first).
+        chunks / manifests: lists of (local path, attachment name); manifests are sent
+        to the primary channel only, after every chunk, so incomplete objects stay unlisted.
+        supersedes: manifest message ids of the version this upload replaces.
+        folder / sources: for a folder prepared while it uploads, its root metadata (plus the
+        wrapped data key) and the [relative path, local path] pairs still to prepare.
+        """
+        os.makedirs(JOURNAL_DIRECTORY, exist_ok=True)
+        upload_id = uuid.uuid4().hex
+        entry = lambda path, name, entry_targets: {"path": path, "name": name, "targets": entry_targets, "sent_to": []}
+        state = {
+            "upload_id": upload_id,
+            "server_id": str(server_id),
+            "channel_name": channel_name,
+            "object_name": object_name,
+            "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "supersedes": list(supersedes),
+            "targets": list(targets),
+            "entries": [entry(path, name, targets) for path, name in chunks]
+                     + [entry(path, name, targets[:1]) for path, name in manifests],
+        }
+        journal = cls(state, os.path.join(JOURNAL_DIRECTORY, f"{upload_id}.json"))
+        journal.claim() # Claimed before it is visible, so it is never listed as incomplete
+        if folder is not None:
+            state["folder"] = dict(folder, prepared=0)
+            with open(journal._sidecar('sources'), 'w') as f: json.dump(list(sources), f)
+        journal.save()
+        return journal
+
+    @classmethod
+    def load(cls, upload_id):
+        path = os.path.join(JOURNAL_DIRECTORY, f"{os.path.basename(upload_id)}.json")
+        if not os.path.exists(path): return None
+        journal = cls(None, path)
+        return journal if journal.reload() else None
+
+    @property
+    def upload_id(self):
+        return self.state["upload_id"]
+
+    @property
+    def lock_path(self):
+        return self._sidecar('lock')
+
+    def _sidecar(self, suffix):
+        return os.path.join(os.path.dirname(self.path), f"{self.upload_id}.{suffix}")
+
+    def claim(self):
+        """
+        Marks the upload as being sent by this journal object, holding the lock until
+        release() or complete(). Returns False if it is already being sent.
+        """
+        if self._lock_file: return True
+        lock_file = open(self.lock_path, 'a')
+        if not _try_lock(lock_file):
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def release(self):
+        # The lock file itself stays until complete(): deleting it here would let two senders
+        # lock different files under the same name
+        if self._lock_file:
+            _unlock(self._lock_file)
+            self._lock_file.close()
+            self._lock_file = None
+
+    def reload(self):
+        """Re-reads the journal (e.g. after claiming it). Returns False if the upload has completed meanwhile."""
+        try:
+            with open(self.path) as f: self.state = json.load(f)
+        except FileNotFoundError:
+            return False
+        self._by_name = {entry["name"]: entry for entry in self.state["entries"]}
+        if os.path.exists(self._sidecar('log')):
+            with open(self._sidecar('log')) as f:
+                for line in f:
+                    try:
+                        self._apply(json.loads(line))
+                    except ValueError:
+                        break # Torn last line from a crash mid-append
+        return True
+
+    @property
+    def is_active(self):
+        """True while some process is sending this upload."""
+        if self._lock_file: return True
+        if not os.path.exists(self.lock_path): return False
+        with open(self.lock_path, 'a') as probe:
+            if not _try_lock(probe): return True
+            _unlock(probe)
+        return False
+
+    def save(self):
+        """Writes the whole journal and starts a new change log. Only for create and resume."""
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w') as f: json.dump(self.state, f)
+        os.replace(temp_path, self.path) # Atomic, so a crash never leaves a torn journal
+        # Replaying the old log over the new journal would be harmless: every change is idempotent
+        if os.path.exists(self._sidecar('log')): os.remove(self._sidecar('log'))
+        self._by_name = {entry["name"]: entry for entry in self.state["entries"]}
+
+    def _log(self, change):
+        self._apply(change)
+        with open(self._sidecar('log'), 'a') as f: f.write(json.dumps(change) + '\n')
+
+    def _apply(self, change):
+        for path, name, targets in change.get("add", []):
+            if name not in self._by_name:
+                entry = self._by_name[name] = {"path": path, "name": name, "targets": targets, "sent_to": []}
+                self.state["entries"].append(entry)
+        if "sent" in change:
+            sent_to = self._by_name[change["sent"]]["sent_to"]
+            if change["channel"] not in sent_to: sent_to.append(change["channel"])
+        if "prepared" in change: self.state["folder"]["prepared"] = change["prepared"]
+        if change.get("sealed"): self.state["folder"]["sealed"] = True
+
+    def pending(self):
+        """Yields (entry, channel ids still missing it) for every unfinished entry, in send order."""
+        for entry in self.state["entries"]:
+            missing = [target for target in entry["targets"] if target not in entry["sent_to"]]
+            if missing: yield entry, missing
+
+    def add_chunks(self, chunks):
+        """Appends (local path, attachment name) chunks to send to every target."""
+        self._log({"add": [[path, name, self.state["targets"]] for path, name in chunks]})
+
+    def add_manifests(self, manifests):
+        """Appends the (local path, attachment name) manifests of a folder prepared while uploading."""
+        self._log({"add": [[path, name, self.state["targets"][:1]] for path, name in manifests], "sealed": True})
+
+    def remaining_sources(self):
+        """Returns the [relative path, local path] pairs of a folder not prepared yet."""
+        with open(self._sidecar('sources')) as f: sources = json.load(f)
+        return sources[self.state["folder"]["prepared"]:]
+
+    def record_file(self, relative_path, entry, chunks):
+        """Records one prepared folder file: its tree entry and its chunks to send."""
+        with open(self._sidecar('files'), 'a') as f: f.write(json.dumps([relative_path, entry]) + '\n')
+        self._log({"add": [[path, name, self.state["targets"]] for path, name in chunks],
+                   "prepared": self.state["folder"]["prepared"] + 1})
+
+    def prepared_files(self):
+        """Returns [(relative path, tree entry)] for every prepared folder file."""
+        if not os.path.exists(self._sidecar('files')): return []
+        with open(self._sidecar('files')) as f:
+            # A crash between the two writes in record_file can leave one extra line
+            lines = f.readlines()[:self.state["folder"]["prepared"]]
+        return [tuple(json.loads(line)) for line in lines]
+
+    def mark_sent(self, entry, channel_id):
+        self._log({"sent": entry["name"], "channel": channel_id})
+        if set(entry["sent_to"]) >= set(entry["targets"]) and os.path.exists(entry["path"]):
+            os.remove(entry["path"]) # Every target has it; the local copy is no longer needed
+
+    def local_copy(self, attachment_name):
+        """Returns the local file for an attachment if it is still on disk."""
+        for entry in self.state["entries"]:
+            if entry["name"] == attachment_name and os.path.exists(entry["path"]):
+                return entry["path"]
+        return None
+
+    def complete(self):
+        for path in (self.path, self._sidecar('log'), self._sidecar('sources'), self._sidecar('files'), self.lock_path):
+            if os.path.exists(path): os.remove(path)
+        self.release()
+        logger.info(f"Upload journal {self.upload_id} for '{self.state['object_name']}' completed.")
+
+    def summary(self):
+        entries = self.state["entries"]
+        return {
+            "upload_id": self.upload_id,
+            "object_name": self.state["object_name"],
+            "server_id": self.state["server_id"],
+            "channel_name": self.state["channel_name"],
+            "created": self.state["created"],
+            "sent": sum(1 for entry in entries if set(entry["sent_to"]) >= set(entry["targets"])),
+            "total": len(entries),
+        }
+
+def _try_lock(f):
+    """Takes a non-blocking exclusive lock on an open file. Returns False if it is held elsewhere."""
+    try:
+        if fcntl: fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else: msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        return False
+    return True
+
+def _unlock(f):
+    if fcntl: fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else: msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+def incomplete_journals():
+    """Returns every journal that has not finished uploading and is not being sent right now."""
+    if not os.path.exists(JOURNAL_DIRECTORY): return []
+    journals = []
+    for filename in sorted(os.listdir(JOURNAL_DIRECTORY)):
+        if filename.endswith('.json'):
+            journal = UploadJournal.load(filename[:-len('.json')])
+            if journal and not journal.is_active: journals.append(journal)
+    return journals
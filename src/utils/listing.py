@@ -0,0 +1,91 @@
+import base64, json
+
+# --- Listing Queries ---
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+SORT_FIELDS = ("date", "size", "name")
+# Bulky metadata fields the explorer never needs
+SUMMARY_EXCLUDED_FIELDS = ("tree", "chunks", "shards", "shard_starts", "replica_channels")
+
+def entry_name(metadata):
+    return metadata.get("folder_name") or metadata.get("original_filename") or ""
+
+def entry_size(metadata):
+    return metadata.get("original_size") or metadata.get("total_size") or 0
+
+def entry_type(metadata):
+    return "folder" if metadata.get("upload_type") == "folder" else "file"
+
+def summarize(metadata):
+    """Strips a metadata object down to the fields a listing needs."""
+    return {key: value for key, value in metadata.items() if key not in SUMMARY_EXCLUDED_FIELDS}
+
+def _sort_key(metadata, sort):
+    if sort == "size": value = entry_size(metadata)
+    elif sort == "name": value = entry_name(metadata).lower()
+    else: value = metadata.get("upload_date", "")
+    # message_id breaks ties so the ordering (and therefore the cursor) is total
+    return [value, metadata.get("message_id", 0)]
+
+def encode_cursor(key, sort, order):
+    return base64.urlsafe_b64encode(json.dumps({"sort": sort, "order": order, "key": key}).encode()).decode()
+
+def decode_cursor(cursor, sort, order):
+    """Returns the sort key stored in a cursor; raises ValueError unless it was made for this sort and order."""
+    try:
+        state = json.loads(base64.urlsafe_b64decode(str(cursor).encode()))
+        value, message_id = state["key"]
+    except (ValueError, TypeError, KeyError):
+        raise ValueError("Malformed cursor.")
+    if state.get("sort") != sort or state.get("order") != order:
+        raise ValueError("Cursor belongs to a different sort order.")
+    value_type = (int, float) if sort == "size" else str
+    if not isinstance(value, value_type) or isinstance(value, bool) or not isinstance(message_id, int):
+        raise ValueError("Malformed cursor.")
+    return [value, message_id]
+
+def parse_flag(value):
+    """Turns a JSON or form filter value into True, False or None (no filter)."""
+    if value is None or value == "": return None
+    if isinstance(value, bool): return value
+    normalized = str(value).strip().lower()
+    if normalized in ("true", "1", "yes"): return True
+    if normalized in ("false", "0", "no"): return False
+    raise ValueError(f"Invalid boolean filter: {value!r}")
+
+def query_files(files, sort="date", order="desc", prefix="", search="", file_type=None, encrypted=None, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    Filters, sorts and pages a channel listing. The cursor is the sort key of the last
+    entry on the previous page, so pages stay stable while new uploads arrive; it is only
+    valid for the sort and order it was issued with. Bad cursors and filters raise ValueError.
+    Returns {"files": [...], "next_cursor": str | None, "total": int}.
+    """
+    sort = sort if sort in SORT_FIELDS else "date"
+    order = "asc" if order == "asc" else "desc"
+    descending = order == "desc"
+    encrypted = parse_flag(encrypted)
+    if not isinstance(limit, (int, str, type(None))): raise ValueError(f"Invalid limit: {limit!r}")
+    limit = max(1, min(int(limit or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+    prefix, search = (prefix or "").lower(), (search or "").lower()
+
+    matches = [
+        metadata for metadata in files
+        if entry_name(metadata).lower().startswith(prefix)
+        and search in entry_name(metadata).lower()
+        and (not file_type or entry_type(metadata) == file_type)
+        and (encrypted is None or bool(metadata.get("encrypted")) == encrypted)
+    ]
+    matches.sort(key=lambda metadata: _sort_key(metadata, sort), reverse=descending)
+
+    if cursor:
+        after = decode_cursor(cursor, sort, order)
+        matches_after = [
+            metadata for metadata in matches
+            if (_sort_key(metadata, sort) < after if descending else _sort_key(metadata, sort) > after)
+        ]
+    else:
+        matches_after = matches
+
+    page = matches_after[:limit]
+    next_cursor = encode_cursor(_sort_key(page[-1], sort), sort, order) if len(matches_after) > limit else None
+    return {"files": [summarize(metadata) for metadata in page], "next_cursor": next_cursor, "total": len(matches)}
@@ -0,0 +1,158 @@
+import asyncio, bisect, json, zlib
+from .envelope import LEGACY_CIPHER, is_envelope, open_envelope
+
+# --- Manifest Format ---
+# Metadata blobs are compact JSON compressed with zlib behind a magic header.
+# A folder's root metadata is only a summary (file_count, total_size, ...) plus its shard
+# references: the tree itself is split, in path order, into separate attachments listed in
+# the root's "shards", and "shard_starts" holds the first path in each. The shard count is
+# capped so the root (and therefore every listing) stays small however large the folder is.
+MANIFEST_MAGIC = b"DFSM1"
+MANIFEST_FORMAT = "sharded-v2"
+SHARD_TARGET_ENTRIES = 2000 # Files per shard
+MAX_ROOT_SHARDS = 256 # Beyond this many shards, each shard grows instead
+
+def encode_manifest(obj):
+    """Serializes a metadata object into the compact binary manifest format."""
+    return MANIFEST_MAGIC + zlib.compress(json.dumps(obj, separators=(',', ':')).encode(), 9)
+
+def decode_manifest(data):
+    """Parses a binary manifest, falling back to the legacy plain JSON metadata."""
+    if data.startswith(MANIFEST_MAGIC):
+        return json.loads(zlib.decompress(data[len(MANIFEST_MAGIC):]))
+    return json.loads(data)
+
+def read_metadata_blob(content, data_cipher=None):
+    """
+    Decodes a metadata attachment. Envelope blobs carry their own wrapped key; other
+    encrypted blobs (manifest shards, legacy metadata) use data_cipher or the master keys (active and retired).
+    """
+    if is_envelope(content): return open_metadata_blob(content)[0]
+    try:
+        return decode_manifest(content)
+    except Exception:
+        return decode_manifest((data_cipher or LEGACY_CIPHER).decrypt(content))
+
+def open_metadata_blob(content):
+    """
+    Returns (metadata, object_key). object_key is None for unencrypted metadata and for
+    legacy objects encrypted directly with the master cipher.
+    """
+    if is_envelope(content):
+        payload, object_key = open_envelope(content)
+        return decode_manifest(payload), object_key
+    return read_metadata_blob(content), None
+
+def shard_tree(tree, target=SHARD_TARGET_ENTRIES, max_shards=MAX_ROOT_SHARDS):
+    """
+    Splits a folder tree into shards of consecutive paths. Each shard is a partial tree
+    holding about `target` files (more once there would be over max_shards of them).
+    Returns (shards, starts) where starts[i] is the first path stored in shards[i].
+    """
+    leaves = sorted(_iter_leaves(tree), key=lambda leaf: leaf[0])
+    per_shard = max(target, -(-len(leaves) // max_shards))
+    shards, starts = [], []
+    for offset in range(0, len(leaves), per_shard):
+        batch = leaves[offset:offset + per_shard]
+        shard = {}
+        for path, item in batch: _insert(shard, path.split('/'), item)
+        shards.append(shard)
+        starts.append(batch[0][0])
+    return shards, starts
+
+def _iter_leaves(tree, prefix=""):
+    """Yields (relative path, entry) for every file and empty directory."""
+    for name, item in tree.items():
+        path = f"{prefix}{name}"
+        if item.get("type") == "directory" and item.get("children"):
+            yield from _iter_leaves(item["children"], f"{path}/")
+        else:
+            yield path, item
+
+def _insert(tree, parts, item):
+    for part in parts[:-1]:
+        tree = tree.setdefault(part, {"type": "directory", "children": {}})["children"]
+    tree[parts[-1]] = item
+
+def _merge(tree, partial):
+    for name, item in partial.items():
+        if item.get("type") == "directory":
+            directory = tree.setdefault(name, {"type": "directory", "children": {}})
+            _merge(directory["children"], item.get("children", {}))
+        else:
+            tree[name] = item
+
+def tree_from_files(files):
+    """Builds a nested folder tree from (relative path, file entry) pairs."""
+    tree = {}
+    for path, entry in files: _insert(tree, path.split('/'), entry)
+    return tree
+
+def count_files(tree):
+    """Counts the file entries in an (unsharded) folder tree."""
+    return sum(1 for _ in iter_tree_files(tree))
+
+def iter_tree_files(tree, prefix=""):
+    """Yields (relative path, file entry) for every file in an (unsharded) folder tree."""
+    for name, item in tree.items():
+        path = f"{prefix}{name}"
+        if item.get("type") == "directory":
+            yield from iter_tree_files(item.get("children", {}), f"{path}/")
+        else:
+            yield path, item
+
+def _walk(tree, path_parts):
+    current_item = {"type": "directory", "children": tree}
+    for part in path_parts:
+        if current_item.get("type") != "directory": return None
+        current_item = current_item.get("children", {}).get(part)
+        if not current_item: return None
+    return current_item
+
+async def resolve_path(metadata, path_parts, load_shard):
+    """Finds an entry in a folder, loading only the shard(s) that can hold its path."""
+    if metadata.get("format") != MANIFEST_FORMAT:
+        return await _resolve_legacy_path(metadata, path_parts, load_shard)
+    path, starts = '/'.join(path_parts), metadata.get("shard_starts", [])
+    index = bisect.bisect_right(starts, path) - 1
+    # A directory sorts just before its first entry, which may open the next shard
+    candidates = [i for i in (index, index + 1) if 0 <= i < len(starts)]
+    for i in candidates:
+        current_item = _walk(await load_shard(i), path_parts)
+        if current_item: return current_item
+    return None
+
+async def expand_tree(metadata, load_shard):
+    """Returns the fully materialized tree of a folder (used for whole-folder operations)."""
+    if metadata.get("format") != MANIFEST_FORMAT:
+        return await _expand_legacy_tree(metadata.get("tree", {}), load_shard)
+    tree = {}
+    for shard in await asyncio.gather(*(load_shard(i) for i in range(len(metadata.get("shards", []))))):
+        _merge(tree, shard)
+    return tree
+
+# --- sharded-v1 ---
+# Older roots keep the tree itself, with oversized subtrees replaced by
+# {"type": "directory", "shard": <index>} stubs whose children live in shard <index>.
+async def _resolve_legacy_path(metadata, path_parts, load_shard):
+    current_item = {"type": "directory", "children": metadata.get("tree", {})}
+    for part in path_parts:
+        children = await _legacy_children(current_item, load_shard)
+        current_item = children.get(part) if children is not None else None
+        if not current_item: return None
+    return current_item
+
+async def _legacy_children(item, load_shard):
+    if item.get("type") != "directory": return None
+    if "shard" in item: return await load_shard(item["shard"])
+    return item.get("children", {})
+
+async def _expand_legacy_tree(tree, load_shard):
+    expanded = {}
+    for name, item in tree.items():
+        if item.get("type") == "directory":
+            children = await _legacy_children(item, load_shard)
+            expanded[name] = {"type": "directory", "children": await _expand_legacy_tree(children, load_shard)}
+        else:
+            expanded[name] = item
+    return expanded
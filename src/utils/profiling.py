@@ -0,0 +1,141 @@
+import asyncio, cProfile, pstats, json, os, time, types, threading, uuid
+from collections import deque
+from .util import logger, DATA_DIRECTORY
+
+# --- Profiling Setup ---
+# Profiling is opt-in per request and only available when an admin token is configured.
+ADMIN_TOKEN = os.getenv("admin_token")
+PROFILE_DIRECTORY = os.path.join(DATA_DIRECTORY, 'profiles')
+PROFILE_HISTORY = 20 # Number of recent profiles kept on disk and listed at the admin endpoint
+
+_recent_profiles = deque()
+_recent_lock = threading.Lock()
+# cProfile is process-wide (sys.monitoring allows a single profiler), so one request at a time
+_session_lock = threading.Lock()
+
+def is_admin(headers):
+    """Returns True if the request carries the configured admin token."""
+    return bool(ADMIN_TOKEN) and headers.get('X-Admin-Token') == ADMIN_TOKEN
+
+def wants_profile(headers, args):
+    """Checks the per-request profiling flag (header or query string) for admin requests."""
+    flag = headers.get('X-Profile') or args.get('profile')
+    return flag in ('1', 'true') and is_admin(headers)
+
+
+class ProfileSession:
+    """
+    Collects one cProfile covering the Flask handler and the bot loop (a profiler sees
+    every thread on Python 3.12+), plus a timeline of loop steps and blocking waits.
+    """
+    def __init__(self, label):
+        self.label = label
+        self.name = f"{time.strftime('%Y%m%d-%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        self.origin = time.perf_counter()
+        self.events = []
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        """Starts profiling. Returns False if another request (or tool) is already profiling."""
+        if not _session_lock.acquire(blocking=False): return False
+        try:
+            self.profile.enable()
+        except ValueError:
+            _session_lock.release()
+            return False
+        return True
+
+    def _event(self, name, category, start, end, thread):
+        # Chrome trace format ("X" = complete event), timestamps in microseconds
+        self.events.append({
+            "name": name, "cat": category, "ph": "X", "pid": 0, "tid": thread,
+            "ts": (start - self.origin) * 1e6, "dur": (end - start) * 1e6,
+        })
+
+    def run(self, coro, loop):
+        """Schedules a coroutine on the loop with tracing and records time blocked in future.result()."""
+        name = getattr(coro, '__qualname__', repr(coro))
+        future = asyncio.run_coroutine_threadsafe(self._traced(coro, name), loop)
+        start = time.perf_counter()
+        try:
+            return future.result()
+        finally:
+            self._event(f"future.result() <- {name}", "blocked", start, time.perf_counter(), "flask")
+
+    async def _traced(self, coro, name):
+        return await _drive(coro, name, self)
+
+    def finish(self):
+        """Stops profiling and writes the .prof and .trace.json files. Returns the profile name."""
+        try:
+            self.profile.disable()
+        finally:
+            _session_lock.release()
+        self._event(self.label, "request", self.origin, time.perf_counter(), "flask")
+        os.makedirs(PROFILE_DIRECTORY, exist_ok=True)
+
+        pstats.Stats(self.profile).dump_stats(os.path.join(PROFILE_DIRECTORY, f"{self.name}.prof"))
+        with open(os.path.join(PROFILE_DIRECTORY, f"{self.name}.trace.json"), 'w') as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+
+        _remember(self.name, self.label)
+        logger.info(f"Saved request profile '{self.name}' for {self.label}")
+        return self.name
+
+
+@types.coroutine
+def _drive(coro, name, session):
+    """
+    Steps the wrapped coroutine by hand so each slice of work on the loop is timed,
+    while any awaited futures are passed through to the owning Task.
+    """
+    value, error = None, None
+    step = 0
+    while True:
+        start = time.perf_counter()
+        try:
+            yielded = coro.throw(error) if error is not None else coro.send(value)
+        except StopIteration as stop:
+            session._event(f"{name} step {step}", "loop", start, time.perf_counter(), "bot.loop")
+            return stop.value
+        except BaseException:
+            session._event(f"{name} step {step} (raised)", "loop", start, time.perf_counter(), "bot.loop")
+            raise
+        session._event(f"{name} step {step}", "loop", start, time.perf_counter(), "bot.loop")
+        step += 1
+
+        wait_start = time.perf_counter()
+        try:
+            value, error = (yield yielded), None
+        except BaseException as e:
+            value, error = None, e
+        session._event(f"{name} awaiting", "await", wait_start, time.perf_counter(), "bot.loop")
+
+
+def run_threadsafe(coro, loop, session=None):
+    """Runs a coroutine on the bot loop from a Flask thread, profiling it if a session is active."""
+    if session is None:
+        return asyncio.run_coroutine_threadsafe(coro, loop).result()
+    return session.run(coro, loop)
+
+# --- Profile History ---
+def _remember(name, label):
+    with _recent_lock:
+        _recent_profiles.appendleft({"name": name, "label": label, "created": time.strftime("%Y-%m-%d %H:%M:%S")})
+        while len(_recent_profiles) > PROFILE_HISTORY:
+            expired = _recent_profiles.pop()
+            for suffix in ('.prof', '.trace.json'):
+                path = os.path.join(PROFILE_DIRECTORY, expired["name"] + suffix)
+                if os.path.exists(path): os.remove(path)
+
+def recent_profiles():
+    """Returns a list of recently captured profiles, newest first."""
+    with _recent_lock:
+        return list(_recent_profiles)
+
+def profile_file_path(name, kind):
+    """Resolves the path of a stored profile file, or None if it is unknown."""
+    suffix = {'prof': '.prof', 'trace': '.trace.json'}.get(kind)
+    if not suffix or not any(p["name"] == name for p in recent_profiles()): return None
+    path = os.path.join(PROFILE_DIRECTORY, name + suffix)
+    return path if os.path.exists(path) else None
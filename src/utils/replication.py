@@ -0,0 +1,195 @@
+import asyncio, os, time, uuid
+import discord
+from collections import deque
+from .util import logger, DATA_DIRECTORY
+from .scheduler import scheduler, build_file_cache, run_in_background, PRIORITY_BULK_READ, PRIORITY_BACKGROUND
+
+# --- Replication Setup ---
+# Number of channels each chunk is stored in (1 = primary channel only)
+REPLICATION_FACTOR = max(1, int(os.getenv("replication_factor", "1")))
+# Comma-separated channel names used for extra copies, in order of preference
+REPLICA_CHANNEL_NAMES = [name.strip() for name in os.getenv("replica_channels", "").split(',') if name.strip()]
+
+HEDGE_PERCENTILE = 0.95   # Chunk reads slower than this latency percentile are hedged
+HEDGE_MIN_SAMPLES = 20    # Samples needed before the percentile is trusted
+HEDGE_DEFAULT_DELAY = 2.0 # Seconds to wait before hedging until enough samples exist
+REPLICA_INDEX_TTL = 60    # Seconds a replica channel's index is shared across downloads
+
+def resolve_replica_channels(guild, primary_channel):
+    """Returns the extra channels chunks should be copied to for the configured replication factor."""
+    if REPLICATION_FACTOR <= 1: return []
+    replicas = []
+    for name in REPLICA_CHANNEL_NAMES:
+        channel = discord.utils.get(guild.text_channels, name=name)
+        if channel and channel.id != primary_channel.id and channel not in replicas:
+            replicas.append(channel)
+    replicas = replicas[:REPLICATION_FACTOR - 1]
+    if len(replicas) < REPLICATION_FACTOR - 1:
+        logger.warning(f"Replication factor {REPLICATION_FACTOR} requested but only {len(replicas)} replica channel(s) available.")
+    return replicas
+
+
+class LatencyTracker:
+    """Rolling window of chunk read latencies used to pick the hedging delay."""
+    def __init__(self, size=256):
+        self.samples = deque(maxlen=size)
+
+    def record(self, seconds):
+        self.samples.append(seconds)
+
+    def hedge_delay(self):
+        if len(self.samples) < HEDGE_MIN_SAMPLES: return HEDGE_DEFAULT_DELAY
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * HEDGE_PERCENTILE))]
+
+chunk_latency = LatencyTracker()
+
+
+class _ReplicaIndex:
+    """A replica channel's file cache, built once and shared by every download using it."""
+    def __init__(self, channel):
+        self.users = 0
+        self.built = None
+        self.task = run_in_background(self._scan(channel))
+
+    async def _scan(self, channel):
+        logger.info(f"Indexing replica channel '{channel.name}'...")
+        try:
+            cache = await build_file_cache(channel, PRIORITY_BULK_READ)
+        except Exception as e:
+            logger.warning(f"Replica channel '{channel.name}' is unavailable: {e}")
+            cache = None
+        self.built = time.monotonic()
+        return cache
+
+    @property
+    def expired(self):
+        return self.built is not None and time.monotonic() - self.built > REPLICA_INDEX_TTL
+
+# channel id -> _ReplicaIndex
+_replica_indexes = {}
+
+
+class ChunkSources:
+    """
+    Locates chunks across the primary channel and its replicas for one download.
+    A replica's history is only indexed when a read first hedges to it, and the index is
+    shared with other downloads for REPLICA_INDEX_TTL seconds. A replica whose history
+    can't be read is treated as unavailable. close() cancels scans no download needs anymore.
+    """
+    def __init__(self, primary_channel, primary_cache, replica_channels=()):
+        self.channels = [primary_channel, *replica_channels]
+        self._primary = primary_channel
+        self._primary_cache = primary_cache
+        self._indexes = {}
+
+    def _has_replicas(self):
+        return len(self.channels) > 1
+
+    async def _cache_for(self, channel):
+        if channel.id == self._primary.id: return self._primary_cache
+        index = self._indexes.get(channel.id)
+        if index is None:
+            index = _replica_indexes.get(channel.id)
+            if index is None or index.expired:
+                index = _replica_indexes[channel.id] = _ReplicaIndex(channel)
+            index.users += 1
+            self._indexes[channel.id] = index
+        return await asyncio.shield(index.task)
+
+    def _ready_cache(self, channel):
+        if channel.id == self._primary.id: return self._primary_cache
+        index = self._indexes.get(channel.id)
+        return index.task.result() if index and index.task.done() and not index.task.cancelled() else None
+
+    def close(self):
+        """Releases this download's replica indexes, cancelling scans nobody else is waiting for."""
+        for channel_id, index in self._indexes.items():
+            index.users -= 1
+            if index.users == 0 and not index.task.done():
+                index.task.cancel()
+                if _replica_indexes.get(channel_id) is index: del _replica_indexes[channel_id]
+        self._indexes.clear()
+
+    async def _fetch(self, message, priority, admitted=None):
+        async with scheduler.slot(priority, message.channel, cost=0):
+            if admitted: admitted.set()
+            start = time.monotonic()
+            data = await message.attachments[0].read()
+        chunk_latency.record(time.monotonic() - start)
+        return data
+
+    async def _read_from(self, channel, chunk_filename, priority, admitted=None):
+        """Returns the chunk's bytes from one channel, or None if it holds no copy. Sets admitted once the read holds a slot."""
+        cache = await self._cache_for(channel)
+        message = cache.get(chunk_filename) if cache else None
+        if not message: return None
+        return await self._fetch(message, priority, admitted)
+
+    async def read(self, chunk_filename, priority):
+        """
+        Returns the chunk's bytes, or None if no copy exists. Starts on the primary copy and,
+        when a read is slower than the hedge delay, fails or finds no copy, races it against
+        the next replica. The hedge delay counts from when the scheduler admits the read, so
+        time spent queued behind other work never triggers a hedge.
+        """
+        attempts = {}
+        remaining = list(self.channels)
+        admitted = None
+        try:
+            while True:
+                if remaining:
+                    channel = remaining.pop(0)
+                    if admitted: admitted.cancel()
+                    event = asyncio.Event()
+                    admitted = asyncio.ensure_future(event.wait())
+                    attempts[asyncio.ensure_future(self._read_from(channel, chunk_filename, priority, event))] = channel
+                if not attempts: return None
+
+                if remaining:
+                    # Wait for the newest read to get a slot (or for any read to finish) before timing it
+                    await asyncio.wait([*attempts, admitted], return_when=asyncio.FIRST_COMPLETED)
+                    if admitted.done():
+                        done, _ = await asyncio.wait(attempts, timeout=chunk_latency.hedge_delay(), return_when=asyncio.FIRST_COMPLETED)
+                    else:
+                        done = {task for task in attempts if task.done()}
+                else:
+                    done, _ = await asyncio.wait(attempts, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    channel = attempts.pop(task)
+                    if task.exception() is not None:
+                        logger.warning(f"Reading '{chunk_filename}' from '{channel.name}' failed: {task.exception()}")
+                    elif task.result() is not None:
+                        data = task.result()
+                        self._restore_missing(chunk_filename, data)
+                        return data
+                if not done:
+                    logger.info(f"Hedging read of '{chunk_filename}' to another replica.")
+        finally:
+            for task in attempts: task.cancel()
+            if admitted: admitted.cancel()
+
+    def _restore_missing(self, chunk_filename, data):
+        """
+        Re-creates the chunk in the background in any indexed channel that lost its copy.
+        Replicas that were never indexed are not checked; verify_object() in file_ops is
+        the complete check and repair.
+        """
+        if not self._has_replicas(): return
+        for channel in self.channels:
+            cache = self._ready_cache(channel)
+            if cache is not None and chunk_filename not in cache:
+                cache[chunk_filename] = None # Only restore once per download
+                run_in_background(_restore_chunk(channel, chunk_filename, data))
+
+async def _restore_chunk(channel, chunk_filename, data):
+    temp_path = os.path.join(DATA_DIRECTORY, f"{uuid.uuid4()}_replica")
+    try:
+        with open(temp_path, 'wb') as f: f.write(data)
+        async with scheduler.slot(PRIORITY_BACKGROUND, channel):
+            await channel.send(file=discord.File(temp_path, filename=chunk_filename))
+        logger.info(f"Restored missing replica of '{chunk_filename}' in '{channel.name}'.")
+    except Exception as e:
+        logger.error(f"Failed to restore replica of '{chunk_filename}' in '{channel.name}': {e}")
+    finally:
+        if os.path.exists(temp_path): os.remove(temp_path)
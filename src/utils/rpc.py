@@ -0,0 +1,109 @@
+import json, os, socket, struct
+from .envelope import ObjectKey
+from .journal import UploadInterrupted
+
+# --- Transfer Daemon RPC ---
+# Web workers submit Discord work to the transfer daemon (src/app/daemon.py) over a local
+# socket. Every message is a u32 big-endian length followed by a JSON body. File data never
+# crosses the socket: both sides share DATA_DIRECTORY and hand over paths inside it.
+#   transfer_daemon -> "host:port" or "unix:/path/to.sock"; unset runs transfers in-process
+#   daemon_token    -> shared secret every request must carry
+#   daemon_timeout  -> seconds a web worker waits for one operation (default 3600)
+TRANSFER_DAEMON = os.getenv("transfer_daemon", "")
+DAEMON_TOKEN = os.getenv("daemon_token", "")
+DAEMON_TIMEOUT = float(os.getenv("daemon_timeout", "3600"))
+DEFAULT_DAEMON_ADDRESS = "127.0.0.1:7600"
+CONNECT_TIMEOUT = 10
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+
+class TransferError(Exception):
+    """Raised in a web worker when the daemon reports a failed operation."""
+
+class TransferLost(TransferError):
+    """
+    Raised when a request reached the daemon but no answer came back (timeout or dropped
+    connection). The operation may still be running there, so its files must be left alone.
+    """
+
+def parse_address(address):
+    """Returns ("unix", path) or ("tcp", (host, port)) for a transfer_daemon address."""
+    if address.startswith("unix:"): return "unix", address[len("unix:"):]
+    host, _, port = address.rpartition(':')
+    return "tcp", (host or "127.0.0.1", int(port))
+
+# --- Framing ---
+# Data keys travel as their wrapped header; both sides hold the master keys to unwrap them
+def _encode_value(value):
+    if isinstance(value, ObjectKey): return {"__object_key__": value.header}
+    raise TypeError(f"{type(value).__name__} cannot be sent to the transfer daemon.")
+
+def _decode_value(obj):
+    if "__object_key__" in obj: return ObjectKey.unwrap(obj["__object_key__"])
+    return obj
+
+def encode_frame(message):
+    body = json.dumps(message, default=_encode_value).encode()
+    return struct.pack('>I', len(body)) + body
+
+def decode_body(body):
+    return json.loads(body, object_hook=_decode_value)
+
+def _check_length(header):
+    (length,) = struct.unpack('>I', header)
+    if length > MAX_FRAME_SIZE: raise ValueError(f"RPC frame of {length} bytes exceeds the limit.")
+    return length
+
+async def read_frame(reader):
+    """Reads one message from an asyncio stream."""
+    length = _check_length(await reader.readexactly(4))
+    return decode_body(await reader.readexactly(length))
+
+def _read_exactly(stream, size):
+    data = stream.read(size)
+    if len(data) < size: raise ConnectionError("Transfer daemon closed the connection.")
+    return data
+
+# --- Errors ---
+def encode_error(error):
+    if isinstance(error, UploadInterrupted):
+        return {"type": "UploadInterrupted", "upload_id": error.upload_id, "message": str(error.cause)}
+    return {"type": type(error).__name__, "message": str(error)}
+
+def _raise_error(error):
+    # Interrupted uploads keep their type so callers can offer to resume them,
+    # and invalid arguments so routes can answer 400
+    if error["type"] == "UploadInterrupted": raise UploadInterrupted(error["upload_id"], error["message"])
+    if error["type"] == "ValueError": raise ValueError(error["message"])
+    raise TransferError(f"{error['type']}: {error['message']}")
+
+# --- Client ---
+def call_daemon(operation, *args, requester=None, **kwargs):
+    """
+    Runs a whitelisted transfer operation on the daemon and blocks until it returns,
+    for at most DAEMON_TIMEOUT seconds (the operation itself keeps running on the daemon).
+    """
+    kind, address = parse_address(TRANSFER_DAEMON)
+    try:
+        if kind == "unix":
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(CONNECT_TIMEOUT)
+            sock.connect(address)
+        else:
+            sock = socket.create_connection(address, timeout=CONNECT_TIMEOUT)
+    except socket.timeout:
+        raise TransferError(f"Transfer daemon at {TRANSFER_DAEMON} did not accept the connection.")
+
+    request = {"token": DAEMON_TOKEN, "op": operation, "args": args, "kwargs": kwargs, "requester": requester}
+    with sock, sock.makefile('rb') as stream:
+        sock.settimeout(DAEMON_TIMEOUT)
+        sock.sendall(encode_frame(request))
+        try:
+            response = decode_body(_read_exactly(stream, _check_length(_read_exactly(stream, 4))))
+        except socket.timeout:
+            raise TransferLost(f"Transfer daemon did not finish '{operation}' within {DAEMON_TIMEOUT:g}s.")
+        except OSError as e: # ConnectionError included
+            raise TransferLost(f"Lost the transfer daemon during '{operation}': {e}")
+
+    if "error" in response: _raise_error(response["error"])
+    return response["result"]
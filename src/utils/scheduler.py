@@ -0,0 +1,227 @@
+import asyncio, contextvars, time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+# --- Scheduler Setup ---
+# Priority classes, lowest value is served first
+PRIORITY_INTERACTIVE = 0 # Listings, metadata reads, small downloads
+PRIORITY_BULK_READ = 1   # Whole-folder and large-file downloads
+PRIORITY_WRITE = 2       # Uploads
+PRIORITY_BACKGROUND = 3  # Deletes and other maintenance work
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_BULK_READ: "bulk_read",
+    PRIORITY_WRITE: "write",
+    PRIORITY_BACKGROUND: "background",
+}
+
+API_RATE = 10.0       # Discord API requests refilled per second
+API_BURST = 20        # Maximum stored request budget
+API_RESERVE = 5       # Budget only interactive work may dip into
+MAX_ACTIVE = 8        # Concurrent Discord operations (API calls and CDN reads)
+WRITE_INTERVAL = 1.5  # Minimum seconds between uploads to the same channel
+AGING_INTERVAL = 5.0  # Seconds of waiting that promote a waiter by one priority class
+INTERACTIVE_CHUNK_LIMIT = 3 # Downloads with more chunks than this are scheduled as bulk reads
+
+current_requester = contextvars.ContextVar('current_requester', default='anonymous')
+
+async def _with_requester(coro, requester):
+    current_requester.set(requester)
+    return await coro
+
+def as_requester(coro, requester):
+    """Wraps a coroutine so the Discord calls it makes are attributed to the given requester."""
+    wrapped = _with_requester(coro, requester or 'anonymous')
+    wrapped.__qualname__ = getattr(coro, '__qualname__', wrapped.__qualname__)
+    return wrapped
+
+
+class _Waiter:
+    __slots__ = ('priority', 'requester', 'channel', 'cost', 'future', 'queued')
+
+    def __init__(self, priority, requester, channel, cost, future):
+        self.priority = priority
+        self.requester = requester
+        self.channel = channel
+        self.cost = cost
+        self.future = future
+        self.queued = time.monotonic()
+
+
+class DiscordScheduler:
+    """
+    Central admission control for Discord calls made by file_ops. Waiters are queued per
+    priority class and per requester; classes are served by priority, requesters within a
+    class round-robin. Waiting ages a waiter into higher classes, so sustained interactive
+    traffic can delay but never starve background work. A token bucket models the API
+    budget, with a reserve that only interactive work may use, and uploads are paced per channel.
+    """
+    def __init__(self, rate=API_RATE, burst=API_BURST, reserve=API_RESERVE, max_active=MAX_ACTIVE, write_interval=WRITE_INTERVAL, aging_interval=AGING_INTERVAL):
+        self.rate = rate
+        self.burst = burst
+        self.reserve = reserve
+        self.max_active = max_active
+        self.write_interval = write_interval
+        self.aging_interval = aging_interval
+        self._queues = {priority: OrderedDict() for priority in PRIORITY_NAMES}
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._active = 0
+        self._next_write = {}
+        self._wakeup = None
+
+    @asynccontextmanager
+    async def slot(self, priority, channel=None, cost=1):
+        """Waits for an admission slot; `cost` is the number of API calls the block will make."""
+        waiter = _Waiter(
+            priority, current_requester.get(), getattr(channel, 'id', channel),
+            min(cost, self.burst), asyncio.get_running_loop().create_future()
+        )
+        self._queues[priority].setdefault(waiter.requester, deque()).append(waiter)
+        self._pump()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self._release()
+            else:
+                self._discard(waiter)
+            raise
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _release(self):
+        self._active -= 1
+        self._pump()
+
+    def _discard(self, waiter):
+        queue = self._queues[waiter.priority]
+        pending = queue.get(waiter.requester)
+        if pending and waiter in pending:
+            pending.remove(waiter)
+            if not pending: del queue[waiter.requester]
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _effective_priority(self, waiter, now):
+        """A waiter is promoted one class for every aging_interval it has waited."""
+        return max(PRIORITY_INTERACTIVE, waiter.priority - int((now - waiter.queued) / self.aging_interval))
+
+    def _ready_at(self, waiter, now):
+        """Returns 0 if the waiter may run now, otherwise the monotonic time it may be ready."""
+        # Work aged into the interactive class may use the reserve too, or it could still starve
+        floor = 0 if self._effective_priority(waiter, now) == PRIORITY_INTERACTIVE else self.reserve
+        ready = now
+        shortfall = waiter.cost + floor - self._tokens
+        if waiter.cost and shortfall > 0:
+            ready = max(ready, now + shortfall / self.rate)
+        if waiter.priority == PRIORITY_WRITE and waiter.channel is not None:
+            ready = max(ready, self._next_write.get(waiter.channel, now))
+        return 0 if ready <= now else ready
+
+    def _next_eligible(self, now):
+        # Each class offers its first ready requester in round-robin order; the candidate with
+        # the best aged priority wins, and the longest waiting one breaks ties
+        earliest, best = None, None
+        for priority in sorted(self._queues):
+            queue = self._queues[priority]
+            for requester in queue:
+                waiter = queue[requester][0]
+                ready = self._ready_at(waiter, now)
+                if ready:
+                    earliest = ready if earliest is None else min(earliest, ready)
+                    continue
+                rank = (self._effective_priority(waiter, now), waiter.queued)
+                if best is None or rank < best[0]: best = (rank, queue, requester)
+                break
+        if best is None: return None, earliest
+
+        _, queue, requester = best
+        waiter = queue[requester].popleft()
+        if queue[requester]:
+            queue.move_to_end(requester) # Round-robin between requesters
+        else:
+            del queue[requester]
+        return waiter, None
+
+    def _pump(self):
+        now = time.monotonic()
+        self._refill(now)
+        earliest = None
+        while self._active < self.max_active:
+            waiter, earliest = self._next_eligible(now)
+            if waiter is None: break
+            if waiter.future.cancelled(): continue
+            self._tokens -= waiter.cost
+            self._active += 1
+            if waiter.priority == PRIORITY_WRITE and waiter.channel is not None:
+                self._next_write[waiter.channel] = now + self.write_interval
+            waiter.future.set_result(None)
+
+        if earliest is not None and self._active < self.max_active:
+            if self._wakeup: self._wakeup.cancel()
+            self._wakeup = asyncio.get_running_loop().call_later(earliest - now, self._pump)
+
+    def snapshot(self):
+        """Returns current queue depths and budget for operators."""
+        now = time.monotonic()
+        self._refill(now)
+        return {
+            "active": self._active,
+            "max_active": self.max_active,
+            "api_budget": round(self._tokens, 2),
+            "queues": {
+                PRIORITY_NAMES[priority]: {
+                    "waiting": sum(len(pending) for pending in queue.values()),
+                    "requesters": len(queue),
+                    "oldest_wait": round(max((now - pending[0].queued for pending in queue.values()), default=0), 2),
+                }
+                for priority, queue in self._queues.items()
+            },
+        }
+
+scheduler = DiscordScheduler()
+
+async def scheduled_history(channel, priority, limit=2000):
+    """Iterates channel history, admitting each page of 100 messages through the scheduler."""
+    iterator = aiter(channel.history(limit=limit))
+    while True:
+        async with scheduler.slot(priority, channel):
+            page = []
+            try:
+                while len(page) < 100:
+                    page.append(await anext(iterator))
+            except StopAsyncIteration:
+                pass
+        for message in page: yield message
+        if len(page) < 100: return
+
+async def build_file_cache(channel, priority, messages=None):
+    """
+    Maps attachment filenames to messages. History is read newest first and the newest
+    message wins, so a re-uploaded metadata file shadows the version it replaces.
+    """
+    file_cache = {}
+    if messages is None:
+        messages = [message async for message in scheduled_history(channel, priority)]
+    for message in messages:
+        for attachment in message.attachments:
+            file_cache.setdefault(attachment.filename, message)
+    return file_cache
+
+_background_tasks = set()
+
+def run_in_background(coro):
+    """Starts a fire-and-forget task on the running loop, keeping a reference until it finishes."""
+    task = asyncio.ensure_future(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+async def scheduler_snapshot():
+    """Reads the scheduler state on the bot loop."""
+    return scheduler.snapshot()
@@ -1,5 +1,5 @@
 from ..dis_commands import bot
-import logging, colorlog, os
+import logging, colorlog, os, hashlib, json, uuid
 from cryptography.fernet import Fernet
 from dotenv import load_dotenv
 load_dotenv()
@@ -56,15 +56,23 @@ PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(_
 DATA_DIRECTORY = os.path.join(PROJECT_ROOT, 'Data')
 if not os.path.exists(DATA_DIRECTORY): os.makedirs(DATA_DIRECTORY)
 
-def process_and_chunk_file(source_path, secure):
+def file_digest(path):
+    """Returns the SHA-256 hex digest of a file's contents, read in CHUNK_SIZE blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b''): digest.update(block)
+    return digest.hexdigest()
+
+def process_and_chunk_file(source_path, secure, data_cipher=None):
     """
     Handles in-place encryption and consistent chunking for any given file.
     All chunks, including for single-part files, will contain '_part_'.
+    When secure, the file is encrypted with the object's data key (data_cipher).
     Returns a tuple of (list of full chunk paths, list of chunk basenames).
     """
     if secure:
         with open(source_path, 'rb') as f: data = f.read()
-        with open(source_path, 'wb') as f: f.write(cipher.encrypt(data))
+        with open(source_path, 'wb') as f: f.write((data_cipher or cipher).encrypt(data))
 
     chunk_paths = []
     chunk_basenames = []
@@ -89,4 +97,19 @@ def process_and_chunk_file(source_path, secure):
     if os.path.exists(source_path):
         os.remove(source_path)
 
-    return chunk_paths, chunk_basenames
\ No newline at end of file
+    return chunk_paths, chunk_basenames
+
+# --- Handoff Files ---
+# Folder trees and chunk lists can outgrow an RPC frame, so they are handed between the web
+# workers and the transfer daemon as JSON files in DATA_DIRECTORY, the same way file data is.
+def write_handoff(obj):
+    """Writes obj to a new JSON file in DATA_DIRECTORY and returns its path."""
+    path = os.path.join(DATA_DIRECTORY, f"{uuid.uuid4()}.handoff.json")
+    with open(path, 'w') as f: json.dump(obj, f, separators=(',', ':'))
+    return path
+
+def read_handoff(path):
+    """Reads a handoff file and deletes it; each handoff is read exactly once."""
+    with open(path) as f: obj = json.load(f)
+    os.remove(path)
+    return obj